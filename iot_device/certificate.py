@@ -1,31 +1,78 @@
 #!/usr/bin/env python3
 
-from OpenSSL import crypto
+from .env import Env
+
+from cryptography import x509
+from cryptography.x509.oid import NameOID
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
 from socket import gethostname
+import datetime, os, logging
+
+logger = logging.getLogger(os.path.splitext(os.path.basename(__file__))[0])
+
+# days
+VALIDITY = 10*365
+# regenerate certificates that expire within this many days
+RENEW = 30
+
 
 def create_key_cert_pair():
-    # private key
-    key = crypto.PKey()
-    key.generate_key(crypto.TYPE_RSA, 1024)
-
-    # signed certificate
-    cert = crypto.X509()
-    cert.get_subject().C  = "US"
-    cert.get_subject().ST = "CA"
-    cert.get_subject().L  = "Berkeley"
-    cert.get_subject().O  = "IoT 49"
-    cert.get_subject().OU = "IoT Python"
-    cert.get_subject().CN = gethostname()
-    cert.set_serial_number(1000)
-    cert.gmtime_adj_notBefore(0)
-    cert.gmtime_adj_notAfter(10*365*24*60*60)
-    cert.set_issuer(cert.get_subject())
-    cert.set_pubkey(key)
-    cert.sign(key, 'sha1')
+    """PEM encoded private key (EC P-256) and self-signed certificate (SHA-256)"""
+    key = ec.generate_private_key(ec.SECP256R1())
+
+    name = x509.Name([
+        x509.NameAttribute(NameOID.COUNTRY_NAME, "US"),
+        x509.NameAttribute(NameOID.STATE_OR_PROVINCE_NAME, "CA"),
+        x509.NameAttribute(NameOID.LOCALITY_NAME, "Berkeley"),
+        x509.NameAttribute(NameOID.ORGANIZATION_NAME, "IoT 49"),
+        x509.NameAttribute(NameOID.ORGANIZATIONAL_UNIT_NAME, "IoT Python"),
+        x509.NameAttribute(NameOID.COMMON_NAME, gethostname()),
+    ])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = x509.CertificateBuilder() \
+        .subject_name(name) \
+        .issuer_name(name) \
+        .public_key(key.public_key()) \
+        .serial_number(x509.random_serial_number()) \
+        .not_valid_before(now - datetime.timedelta(minutes=5)) \
+        .not_valid_after(now + datetime.timedelta(days=VALIDITY)) \
+        .sign(key, hashes.SHA256())
 
     return (
-        crypto.dump_privatekey(crypto.FILETYPE_PEM, key),
-        crypto.dump_certificate(crypto.FILETYPE_PEM, cert))
+        key.private_bytes(serialization.Encoding.PEM,
+            serialization.PrivateFormat.PKCS8, serialization.NoEncryption()),
+        cert.public_bytes(serialization.Encoding.PEM))
+
+
+def key_cert_file():
+    """Path of PEM file with the private key and certificate of this host.
+    Created once (readable by owner only) and again only when it is unreadable
+    or about to expire. An existing file readable by others is restricted
+    to the owner."""
+    file = os.path.join(Env.expand_path(Env.iot_cache()), 'server.pem')
+    try:
+        with open(file, 'rb') as f:
+            if os.name == 'posix' and os.fstat(f.fileno()).st_mode & 0o077:
+                # e.g. copied or created by an earlier version; regenerated if this fails
+                logger.warning(f"private key {file} readable by others, restricting to owner")
+                os.chmod(file, 0o600)
+            cert = x509.load_pem_x509_certificate(f.read())
+        expires = cert.not_valid_after_utc - datetime.datetime.now(datetime.timezone.utc)
+        if expires.days >= RENEW:
+            return file
+        logger.info(f"certificate {file} expires in {expires.days} days, renewing")
+    except (OSError, ValueError) as e:
+        logger.debug(f"no certificate in {file}: {e}")
+    key, cert = create_key_cert_pair()
+    os.makedirs(os.path.dirname(file), exist_ok=True)
+    tmp = f"{file}.{os.getpid()}~"
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(key)
+        f.write(cert)
+    os.replace(tmp, file)
+    return file
 
 
 ##########################################################################
@@ -1,5 +1,6 @@
 from .eval import Eval, RemoteError
 from .device_config import DeviceConfig
+from .identity_cache import identity_cache
 
 from abc import ABC, abstractmethod
 import os, threading, time, logging
@@ -9,7 +10,7 @@ logger = logging.getLogger(os.path.splitext(os.path.basename(__file__))[0])
 
 class Device(ABC):
 
-    def __init__(self, url:str):
+    def __init__(self, url:str, hint:str=None):
         """Create device for given URL.
         Retrieves uid from device and raises error if device cannot be contacted.
 
@@ -17,13 +18,53 @@ class Device(ABC):
         e.g.
             serial:///dev/cu.usbmodem1413401
             telnet://mcu.com:23
+        :param: hint:str  identifies the device at url without connecting to it,
+                e.g. USB serial number (see IdentityCache). If the identity
+                is cached, the device is contacted on first use only.
         """
         self._url = url
         # connect to device and retrieve its uid; raise RemoteError if unsuccessful
         self._uid = url
         self._implementation = self_platform = None  # used in repl
-        with self as repl:
-            self._uid, self._implementation, self._platform = repl.exec(_uid, timeout=1).decode().split(' ', 2)
+        # (module, can_compress), probed on first file transfer
+        self.compression = None
+        # fget in base64 frames, fput to a stdin receiver supported; probed on first file transfer
+        self.stream_fget = None
+        self.stream_fput = None
+        # version of helper library (remote_lib) on mcu, checked once per connection
+        self.helpers_version = None
+        # metadata from discovery (e.g. broadcasts), updated by DeviceRegistry
+        self.advertisement = {}
+        self._hint = hint
+        identity = identity_cache.get(url, hint) if hint else None
+        # identity checked on first connection
+        self._verified = identity is None
+        if identity:
+            self._uid, self._implementation, self._platform = identity
+        else:
+            with self as repl:
+                self._identify(repl)
+
+    def verify(self, repl):
+        """Check identity taken from the cache, called when connecting."""
+        if self._verified: return
+        cached = (self._uid, self._implementation, self._platform)
+        try:
+            identity = self._identify(repl)
+        except RemoteError as e:
+            logger.info(f"cannot verify {self.url}: {e}")
+            return
+        self._verified = True
+        if identity != cached:
+            logger.warning(f"{self.url}: expected {cached}, found {identity}")
+
+    def _identify(self, repl):
+        # get uid, implementation & platform from device
+        identity = tuple(repl.exec(_uid, timeout=1).decode().split(' ', 2))
+        self._uid, self._implementation, self._platform = identity
+        if self._hint:
+            identity_cache.put(self.url, self._hint, identity)
+        return identity
 
     @abstractmethod
     def read(self, size=1) -> bytes:
@@ -37,6 +78,27 @@ class Device(ABC):
     def inWaiting(self):
         """Number of bytes available for reading without blocking."""
 
+    def readinto(self, buf) -> int:
+        """Read bytes available without blocking into buf (e.g. a memoryview),
+        at most len(buf). Returns the number of bytes read."""
+        n = min(len(buf), self.inWaiting())
+        if n <= 0: return 0
+        data = self.read(n)
+        buf[:len(data)] = data
+        return len(data)
+
+    def wait_readable(self, timeout) -> bool:
+        """Block until data is available for reading or timeout (seconds) expires.
+        Default polls; subclasses with a file descriptor override this."""
+        time.sleep(min(timeout, 0.01))
+        return self.inWaiting() > 0
+
+    def fileno(self):
+        """File descriptor that is readable when data arrives (for select
+        and event loops) while connected, None if not available or if
+        readinto can block (callers then use wait_readable in a thread)."""
+        return None
+
     @abstractmethod
     def __enter__(self) -> Eval:
         """Usage pattern:
@@ -1,11 +1,8 @@
 # device_conifg.py
 
 from .env import Env
-from .utilities import cd
-from glob import glob
-from fnmatch import fnmatch
 from io import StringIO
-import yaml, os
+import yaml, json, os, re, time, threading
 
 """
 DeviceConfig (from yaml): name, uid, resources (rsync)
@@ -74,71 +71,111 @@ class DeviceConfig:
         """Return DeviceConfig for device with given name or uid
         Raises ValueError if device not found.
         """
-        devs = DeviceConfig.get_device_configs()
-        # check for name
-        if devs.get(name_or_uid): return devs.get(name_or_uid)
-        # search for uid
-        for dev in devs.values():
-            if dev.uid == name_or_uid: return dev
+        store = _store.update()
+        dev = store.by_name.get(name_or_uid) or store.by_uid.get(name_or_uid)
+        if dev: return dev
         raise ValueError(f"No configuration found for: '{name_or_uid}'")
 
     @staticmethod
     def get_device_configs():
         """Return dict name --> DeviceConfig"""
-        result = {}
-        names = set()
-        uids  = set()
-        try:
-            with cd(Env.iot_devices()):
-                for file in glob("*.yaml") + glob("*.yml"):
-                    with open(file) as f:
-                        for name, spec in yaml.safe_load(f.read()).items():
-                            if not isinstance(spec, dict):
-                                raise ValueError(f"File {file}: malformed")
-                            if name in names:
-                                raise ValueError(f"File {file} device '{name}': redefined")
-                            names.add(name)
-                            uid = spec.get('uid')
-                            if not uid:
-                                raise ValueError(f"File {file} device '{name}': field 'uid' is mandatory")
-                            if uid in uids:
-                                raise ValueError(f"File {file} device '{name}': a device with {uid} is already defined elsewhere")
-                            uids.add(uid)
-                            result[name] = DeviceConfig(name, uid, spec, file)
-        except FileNotFoundError as e:
-            # folder Env.iot_devices() does not exist
-            pass
-        return result
+        return dict(_store.update().by_name)
+
+    @staticmethod
+    def reload():
+        """Reread configurations, e.g. after changing IOT_DEVICES.
+        Otherwise changes are picked up within CHECK_INTERVAL seconds."""
+        _store.update(force=True)
 
     @property
     def resources(self):
         return [ _Resource(self, r) for r in self._spec.get('resources', []) ]
     
+    @property
+    def resource_key(self):
+        """Configurations with equal resource_key have the same resource_files"""
+        return json.dumps({ k: v for k, v in self._spec.items() if k != 'uid' }, sort_keys=True, default=str)
+
     @property
     def resource_files(self):
         """Returns a dict
            path_on_mcu -> (mtime, size, path_on_host)
         """
         result = {}
-        sep = os.path.sep
         for r in self.resources:
-            for f in r.files:
-                mcu_file = sep.join(f.strip(sep).split(sep)[1:]) if r.unpack else f
-                mcu_path = os.path.join(r.install_dir, mcu_file)
-                host_path = Env.expand_path(os.path.join(r.path, f))
-                # add folders so rsync won't delete them
-                p = mcu_path
-                while p != '/':
-                    p = os.path.dirname(p)
-                    result[os.path.normpath(p)] = (0, -1, '')
-                # add the file
-                result[mcu_path] = (
-                    os.path.getmtime(host_path), 
-                    os.path.getsize(host_path), 
-                    host_path
-                )            
+            result.update(r.mcu_files())
         return result
 
+class _ConfigStore:
+    """Process wide cache of DeviceConfigs, indexed by name and uid.
+
+    Rebuilt when the list of yaml files in Env.iot_devices() or the mtime
+    or size of one of them changes. Checked at most every CHECK_INTERVAL
+    seconds since lookups (e.g. Device.name) are frequent.
+    """
+
+    CHECK_INTERVAL = 1
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._signature = None
+        self._checked = 0
+        self.by_name = {}
+        self.by_uid = {}
+
+    def update(self, force=False):
+        with self._lock:
+            now = time.monotonic()
+            if force or now - self._checked > self.CHECK_INTERVAL:
+                signature = self._scan()
+                if force or signature != self._signature:
+                    # on error keep old signature, retry on next lookup
+                    self.by_name, self.by_uid = self._load(*signature)
+                    self._signature = signature
+                self._checked = now
+        return self
+
+    @staticmethod
+    def _scan():
+        # folder and (file, mtime, size) of all yaml files in it
+        folder = Env.expand_path(Env.iot_devices())
+        files = []
+        try:
+            with os.scandir(folder) as it:
+                for entry in it:
+                    if entry.name.startswith('.') or not entry.is_file(): continue
+                    if entry.name.endswith('.yaml') or entry.name.endswith('.yml'):
+                        st = entry.stat()
+                        files.append((entry.name, st.st_mtime_ns, st.st_size))
+        except FileNotFoundError:
+            # folder Env.iot_devices() does not exist
+            pass
+        # *.yaml before *.yml
+        files.sort(key=lambda f: (f[0].endswith('.yml'), f[0]))
+        return folder, tuple(files)
+
+    @staticmethod
+    def _load(folder, files):
+        by_name = {}
+        by_uid = {}
+        for file, _, _ in files:
+            with open(os.path.join(folder, file)) as f:
+                for name, spec in (yaml.safe_load(f.read()) or {}).items():
+                    if not isinstance(spec, dict):
+                        raise ValueError(f"File {file}: malformed")
+                    if name in by_name:
+                        raise ValueError(f"File {file} device '{name}': redefined")
+                    uid = spec.get('uid')
+                    if not uid:
+                        raise ValueError(f"File {file} device '{name}': field 'uid' is mandatory")
+                    if uid in by_uid:
+                        raise ValueError(f"File {file} device '{name}': a device with {uid} is already defined elsewhere")
+                    by_name[name] = by_uid[uid] = DeviceConfig(name, uid, spec, file)
+        return by_name, by_uid
+
+_store = _ConfigStore()
+
+
 class _Resource:
     """Single Resource specified in yaml file"""
 
@@ -166,25 +203,75 @@ class _Resource:
     @property
     def files(self):
         """List of files in this resource, path relative lib"""
-        result = []
-        includes = self._param.get('include-patterns', self._dev._spec.get('include-patterns', [ './**/*.py', './**/*.mpy', './**/' ]))
-        excludes = self._param.get('exclude-patterns', self._dev._spec.get('exclude-patterns', [ 'boot_out.txt' ]))
-        if isinstance(includes, str): includes = [ includes ]
-        if isinstance(excludes, str): excludes = [ excludes ]
-        path = os.path.join(self.path, self.name)
-        if os.path.isfile(Env.expand_path(path)): return [ self.name ]
+        return list(self.scan())
+
+    def scan(self):
+        """Dict file -> (mtime, size) of files in this resource, path relative lib.
+
+        include-patterns are glob patterns relative to the resource folder
+        (** matches any number of folders). exclude-patterns without / match
+        file and folder names at any level, others paths relative to the
+        resource folder (e.g. /data). Hidden files are skipped.
+        """
+        path = self.host_path
         try:
-            with cd(path):
-                for inc in includes:
-                    for file in glob(inc, recursive=True):
-                        if not os.path.isfile(file): continue
-                        for ex in excludes:
-                            if fnmatch(file, ex): continue
-                        result.append(os.path.normpath(os.path.join(self.name, file)))
+            st = os.stat(path)
         except OSError:
-            pass
+            return {}
+        if not os.path.isdir(path):
+            return { self.name: (st.st_mtime, st.st_size) }
+        includes = self._param.get('include-patterns', self._dev._spec.get('include-patterns', [ './**/*.py', './**/*.mpy', './**/' ]))
+        excludes = self._param.get('exclude-patterns', self._dev._spec.get('exclude-patterns', [ 'boot_out.txt' ]))
+        include, max_depth = _include_matcher(includes)
+        exclude = _exclude_matcher(excludes)
+        result = {}
+        # (folder, path relative resource folder, depth)
+        stack = [ (path, '', 0) ]
+        while stack:
+            folder, rel, depth = stack.pop()
+            try:
+                it = os.scandir(folder)
+            except OSError:
+                continue
+            with it:
+                for entry in it:
+                    if entry.name.startswith('.'): continue
+                    p = rel + entry.name
+                    if exclude(p): continue
+                    try:
+                        if entry.is_dir():
+                            if depth < max_depth:
+                                stack.append((entry.path, p + '/', depth + 1))
+                        elif include(p):
+                            st = entry.stat()
+                            result[os.path.join(self.name, p)] = (st.st_mtime, st.st_size)
+                    except OSError:
+                        # e.g. dangling symlink
+                        pass
+        return result
+
+    def mcu_files(self):
+        """Dict path_on_mcu -> (mtime, size, path_on_host), including folders"""
+        result = {}
+        sep = os.path.sep
+        for f, (mtime, size) in self.scan().items():
+            mcu_file = sep.join(f.strip(sep).split(sep)[1:]) if self.unpack else f
+            mcu_path = os.path.join(self.install_dir, mcu_file)
+            host_path = Env.expand_path(os.path.join(self.path, f))
+            # add folders so rsync won't delete them
+            p = mcu_path
+            while p != '/':
+                p = os.path.dirname(p)
+                result[os.path.normpath(p)] = (0, -1, '')
+            # add the file
+            result[mcu_path] = (mtime, size, host_path)
         return result
 
+    @property
+    def host_path(self):
+        """File or folder of this resource on the host"""
+        return os.path.join(self.path, self.name)
+
     @property
     def unpack(self):
         """Upload directory (unpack False) or contents (unpack True)"""
@@ -219,4 +306,74 @@ class _Resource:
             print(f)
         return f"{os.path.join(self.install_dir, self.name)} ({self.path})"
         return f"Res {self.name:22} install-dir={self.install_dir:22} path={self.path}"
-    
\ No newline at end of file
+    
+
+
+###############################################################################
+# include & exclude patterns
+
+def _glob_regex(pattern):
+    """Regular expression for glob pattern, ** matches any number of folders"""
+    res = []
+    i, n = 0, len(pattern)
+    while i < n:
+        c = pattern[i]
+        if pattern.startswith('**/', i):
+            res.append('(?:[^/]*/)*')
+            i += 3
+            continue
+        if pattern.startswith('**', i):
+            res.append('.*')
+            i += 2
+            continue
+        if c == '*':
+            res.append('[^/]*')
+        elif c == '?':
+            res.append('[^/]')
+        elif c == '[' and pattern.find(']', i+2) > 0:
+            j = pattern.find(']', i+2)
+            chars = pattern[i+1:j].replace('\\', '\\\\')
+            if chars[0] == '!':
+                # like glob, never matches the path separator
+                chars = '^/' + chars[1:]
+            elif chars[0] == '^':
+                chars = '\\' + chars
+            res.append('[' + chars + ']')
+            i = j
+        else:
+            res.append(re.escape(c))
+        i += 1
+    return ''.join(res)
+
+def _strip_dot(pattern):
+    while pattern.startswith('./'):
+        pattern = pattern[2:]
+    return pattern
+
+def _include_matcher(patterns):
+    """Return (match function, maximum folder depth of matches)"""
+    if isinstance(patterns, str): patterns = [ patterns ]
+    patterns = [ _strip_dot(p).lstrip('/') for p in patterns ]
+    # patterns ending in / match folders only, i.e. no files
+    patterns = [ p for p in patterns if p and not p.endswith('/') ]
+    if not patterns:
+        return (lambda path: False), 0
+    max_depth = max(float('inf') if '**' in p else p.count('/') for p in patterns)
+    regex = re.compile('(?:' + '|'.join(_glob_regex(p) for p in patterns) + r')\Z')
+    return regex.match, max_depth
+
+def _exclude_matcher(patterns):
+    if isinstance(patterns, str): patterns = [ patterns ]
+    res = []
+    for p in patterns:
+        # ./data and /data are relative to the resource folder, as is x/data
+        anchored = p.startswith('./') or p.startswith('/')
+        p = _strip_dot(p).strip('/')
+        if not p: continue
+        if anchored or '/' in p:
+            res.append(_glob_regex(p))
+        else:
+            res.append('(?:.*/)?' + _glob_regex(p))
+    if not res:
+        return lambda path: False
+    return re.compile('(?:' + '|'.join(res) + r')\Z').match
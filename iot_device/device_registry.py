@@ -1,44 +1,119 @@
 from .eval import RemoteError
 from .device import Device
+from .identity_cache import identity_cache
 from .discover_serial import DiscoverSerial
 from .discover_broadcasts import DiscoverBroadcasts
 from .discover_mdns import DiscoverMdns
 from serial import SerialException
-import os, logging, threading, time
+from .eval_rsync import watch
+from concurrent.futures import ThreadPoolExecutor, Future, wait
+from contextlib import ExitStack
+import os, logging, random, threading, time
 
 logger = logging.getLogger(os.path.splitext(os.path.basename(__file__))[0])
 
 
 class DeviceRegistry:
-    """Keeps track of currently available devices"""
+    """Keeps track of currently available devices
 
-    def __init__(self):
-        self._discover_serial = DiscoverSerial()
-        self._discover_broadcasts = DiscoverBroadcasts(10)
-        self._discover_mdns = DiscoverMdns()
+    Discovery runs in a background thread, each source (serial ports,
+    broadcasts, mdns) at its own interval. Lookups read a snapshot of the
+    registered devices, indexed by name, uid and url, without waiting for
+    discovery (except for the first pass after creation).
+    """
+
+    # seconds between scans, per discovery source
+    SCAN_INTERVALS = { 'serial': 1, 'broadcasts': 1, 'mdns': 5 }
+
+    # maximum number of concurrent registrations, per scheme
+    # (serial ports are independent, network devices may share an access point)
+    REGISTER_LIMITS = { 'serial': 8, 'ws': 4, 'wss': 4, 'telnet': 4, 'mp': 4 }
+
+    # seconds before retrying a failed registration: BACKOFF_MIN, doubled
+    # after each failure up to BACKOFF_MAX, randomized by +/- BACKOFF_JITTER
+    BACKOFF_MIN = 5
+    BACKOFF_MAX = 600
+    BACKOFF_JITTER = 0.25
+
+    def __init__(self, scan_intervals:dict=None, register_limits:dict=None):
+        self._sources = {
+            'serial': DiscoverSerial(),
+            'broadcasts': DiscoverBroadcasts(10),
+            'mdns': DiscoverMdns(),
+        }
+        self._intervals = dict(self.SCAN_INTERVALS, **(scan_intervals or {}))
+        # protects _devices, _registration_failed, _snapshot
+        self._lock = threading.RLock()
+        # serializes notifications of listeners, never held with _lock while notifying
+        self._publish_lock = threading.Lock()
+        self._limits = dict(self.REGISTER_LIMITS, **(register_limits or {}))
+        # scheme -> registration thread pool
+        self._pools = {}
+        # url -> Future of registration in progress
+        self._pending = {}
         # map url -> device
         self._devices = {}
-        # map url -> time of last attempt
+        # map url -> _Failure
         self._registration_failed = {}
+        # registration counters
+        self._stats = dict.fromkeys(('attempts', 'registered', 'failed', 'skipped'), 0)
+        self._snapshot = _Snapshot()
+        self._listeners = []
+        # set after first discovery pass
+        self._ready = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._discover, name='device-discovery', daemon=True)
+        self._thread.start()
+
+    def close(self):
+        """Stop discovery"""
+        self._stop.set()
+        for source in self._sources.values():
+            close = getattr(source, 'close', None)
+            if close: close()
 
     def clear(self):
         """Forget all registered devices"""
-        # map url -> device
-        self._devices = {}
-        # map url -> time of last attempt
-        self._registration_failed = {}
+        with self._lock:
+            # map url -> device
+            self._devices = {}
+            # map url -> _Failure
+            self._registration_failed = {}
+        self._publish()
+
+    @property
+    def registration_stats(self) -> dict:
+        """Counters: attempts, registered, failed, and skipped (backing off after failure),
+        and failing: dict url -> (failures, seconds until next attempt, last error)"""
+        now = time.monotonic()
+        with self._lock:
+            stats = dict(self._stats)
+            stats['failing'] = {
+                url: (f.count, max(0, f.retry - now), f.error) for url, f in self._registration_failed.items() }
+        return stats
 
     @property
     def devices(self) -> frozenset:
         """List of all devices that are currently online."""
-        self._update()
-        return frozenset(self._devices.values())
+        self._ready.wait()
+        return self._snapshot.devices
+
+    def register_listener(self, listener):
+        """listener.register_device(url, device) and listener.unregister_device(url)
+        are called when devices are added or removed.
+        register_device is called for devices already registered."""
+        with self._publish_lock:
+            with self._lock:
+                self._listeners.append(listener)
+                devices = self._snapshot.devices
+            for dev in devices:
+                _notify(listener.register_device, dev.url, dev)
 
     def get_device(self, name: str, schemes=None) -> Device:
         """Device with given name/uid/url & schemes."""
         if name:
-            self._update()
-            if '://' in name and not name in self._devices:
+            self._ready.wait()
+            if '://' in name and not name in self._snapshot.by_url:
                 # auto-register URL
                 try:
                     self.register(name)
@@ -46,30 +121,159 @@ class DeviceRegistry:
                     pass
             if schemes == None or len(schemes) == 0:
                 schemes = ['serial', 'ws', 'mp']
+            snapshot = self._snapshot
             for scheme in schemes:
-                for dev in self._devices.values():
-                    if (dev.name == name or dev.uid == name or dev.url == name) and dev.scheme == scheme:
-                        return dev
+                for index in (snapshot.by_name, snapshot.by_uid, snapshot.by_url):
+                    dev = index.get(name, {}).get(scheme)
+                    if dev: return dev
         return None
 
-    def _update(self):
+    def rsync_all(self, names=None, *, workers:int=4, data_consumer=None, **kwargs) -> list:
+        """rsync many devices concurrently, one connection per device.
+        :param: names  device names, uids or urls; None for all devices with a configuration
+        :param: workers  maximum number of devices synchronized in parallel
+        :param: data_consumer  output, prefixed with device name (default print)
+        :param: kwargs  passed to EvalRsync.rsync (e.g. dry_run=False)
+        Returns list of dicts with device name, url, seconds, result of rsync, and error.
+        """
+        if data_consumer is None:
+            data_consumer = lambda s: print(s, end='', flush=True)
+        devices = self._configured_devices(names)
+        # scan host files once per configuration (not thread safe)
+        host_files = {}
+        # url -> resource key, or error (e.g. no configuration) reported in the summary
+        keys = {}
+        for dev in devices:
+            try:
+                key = keys[dev.url] = dev.config.resource_key
+                if not key in host_files:
+                    host_files[key] = dev.config.resource_files
+            except Exception as e:
+                keys[dev.url] = e
+        lock = threading.Lock()
+
+        def sync(dev):
+            out = _PrefixOutput(dev.name, data_consumer, lock)
+            summary = { 'name': dev.name, 'url': dev.url, 'result': None, 'error': None }
+            start = time.monotonic()
+            try:
+                key = keys[dev.url]
+                if isinstance(key, Exception): raise key
+                with dev as repl:
+                    summary['result'] = repl.rsync(out, host_files=host_files[key], **kwargs)
+            except Exception as e:
+                logger.exception(f"rsync {dev.name}")
+                summary['error'] = str(e)
+                out(f"FAILED: {e}\n")
+            out.flush()
+            summary['seconds'] = time.monotonic() - start
+            return summary
+
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            summaries = list(pool.map(sync, devices))
+        data_consumer(_rsync_table(summaries))
+        return summaries
+
+    def watch_all(self, names=None, *, data_consumer=None, **kwargs) -> int:
+        """Push changes of resource files to devices as they are saved.
+        Keeps a connection to each device open until KeyboardInterrupt.
+        :param: names  device names, uids or urls; None for all devices with a configuration
+        :param: kwargs  passed to eval_rsync.watch (e.g. upload_only=False)
+        Returns number of pushes.
+        """
+        if data_consumer is None:
+            data_consumer = lambda s: print(s, end='', flush=True)
+        devices = self._configured_devices(names)
+        with ExitStack() as stack:
+            repls = [ stack.enter_context(dev) for dev in devices ]
+            return watch(repls, data_consumer, **kwargs)
+
+    def _configured_devices(self, names):
+        # devices with given names or all devices with a configuration
+        if names is None:
+            devices = []
+            for dev in sorted(self.devices, key=lambda d: d.name):
+                try:
+                    dev.config
+                    devices.append(dev)
+                except ValueError:
+                    pass
+            return devices
+        devices = [ self.get_device(name) for name in names ]
+        missing = [ name for name, dev in zip(names, devices) if dev is None ]
+        if missing:
+            raise ValueError(f"Devices not found: {missing}")
+        return devices
+
+    def _discover(self):
+        # discovery thread
+        urls = { name: set() for name in self._sources }
+        # url -> hint from discovery (see IdentityCache)
+        hints = {}
+        # url -> advertised metadata
+        info = {}
+        next_scan = { name: 0 for name in self._sources }
+        first = True
+        while not self._stop.is_set():
+            now = time.monotonic()
+            for name, source in self._sources.items():
+                if now < next_scan[name]: continue
+                next_scan[name] = now + self._intervals.get(name, 5)
+                try:
+                    last, urls[name] = urls[name], source.scan()
+                    if name == 'broadcasts':
+                        # (re)started device, retry failed registration now
+                        self._reset_failures(urls[name] - last)
+                    for url in urls[name]:
+                        hints[url] = source.hint(url)
+                        info[url] = source.info(url)
+                except Exception as e:
+                    logger.exception(f"discovery {name}: {e}")
+            try:
+                found = set().union(*urls.values())
+                hints = { url: h for url, h in hints.items() if url in found }
+                info = { url: i for url, i in info.items() if url in found }
+                futures = self._update(found, hints, info)
+                if first:
+                    # devices online at startup are in the first snapshot
+                    wait(futures)
+            except Exception as e:
+                logger.exception(f"discovery: {e}")
+            first = False
+            self._ready.set()
+            self._stop.wait(max(0.1, min(next_scan.values()) - time.monotonic()))
+
+    def _update(self, urls, hints={}, info={}):
         # update database ...
-        urls = self._discover_serial.scan() | self._discover_broadcasts.scan() | self._discover_mdns.scan()
         # 1) purge database
         now = time.monotonic()
-        for url in list(self._devices.keys()):
-            dev = self._devices[url]
-            if not dev.max_age: continue
-            if (now-dev.last_seen) > dev.max_age:
-                del self._devices[url]
-        # 2) register discovered devices
+        with self._lock:
+            for url in list(self._devices.keys()):
+                dev = self._devices[url]
+                if url in urls:
+                    dev.last_seen = now
+                    dev.advertisement = info.get(url) or {}
+                if not dev.max_age: continue
+                if (now-dev.last_seen) > dev.max_age:
+                    del self._devices[url]
+        # 2) register discovered devices, in parallel
+        futures = []
         for url in urls:
+            hint, i = hints.get(url), info.get(url) or {}
+            if hint and all(k in i for k in ('uid', 'implementation', 'platform')):
+                # advertised identity, no need to contact device
+                identity_cache.put(url, hint, (i['uid'], i['implementation'], i['platform']))
             try:
-                self.register(url)
-            except (ValueError, RemoteError) as e:
-                # leave this print statement - will show up in jupyter!
-                print(f"\nFailed to register {url}:\n{e}\n")
+                future = self._register_async(url, hint=hint)
+            except ValueError as e:
                 logger.info(f"Failed to register {url}: {e}")
+                continue
+            if not future.done():
+                future.add_done_callback(lambda f, url=url: self._report(url, f))
+            futures.append(future)
+        # names may have changed (device configuration)
+        self._publish()
+        return futures
 
     def register(self, url:str, max_age:float=10):
         """Create device for given url and register in database.
@@ -80,43 +284,151 @@ class DeviceRegistry:
                 Issue: replacing devices recycles port (/dev), resulting
                        in database out of sync.
         """
-        if url in self._registration_failed.keys():
-            if (time.monotonic() - self._registration_failed[url]) < 30:
-                logger.info(f"skipping failed registration for '{url}'")
-                return
-            del self._registration_failed[url]
-        if url in self._devices.keys():
-            # already in database
-            self._devices[url].last_seen = time.monotonic()
-            return
-        # create a new device
-        logger.debug(f"register {url}")
+        self._register_async(url, max_age).result()
+
+    def _register_async(self, url, max_age=10, hint=None) -> Future:
+        # Future of registration, shared with registrations of url in progress.
+        # Raises ValueError if url is invalid.
         device_class = find_device_class(url)
+        with self._lock:
+            failure = self._registration_failed.get(url)
+            if failure and time.monotonic() < failure.retry:
+                logger.debug(f"skipping failed registration for '{url}'")
+                self._stats['skipped'] += 1
+                return _DONE
+            if url in self._devices.keys():
+                # already in database
+                self._devices[url].last_seen = time.monotonic()
+                return _DONE
+            future = self._pending.get(url)
+            if future: return future
+            scheme = url.split('://')[0]
+            pool = self._pools.get(scheme)
+            if not pool:
+                pool = self._pools[scheme] = ThreadPoolExecutor(
+                    max(1, self._limits.get(scheme, 2)), thread_name_prefix=f"register-{scheme}")
+            self._stats['attempts'] += 1
+            future = self._pending[url] = pool.submit(self._register, url, device_class, max_age, hint)
+        future.add_done_callback(lambda f: self._pending.pop(url, None))
+        return future
+
+    def _register(self, url, device_class, max_age, hint):
+        # create a new device (connects to it, do not hold the lock)
+        logger.debug(f"register {url}")
         try:
-            device = device_class(url)
+            device = device_class(url, hint)
         except Exception as e:
-            self._registration_failed[url] = time.monotonic()
             msg = str(e)
             if url.startswith('ws'): msg += " (wrong password?)"
             msg = f"Registration failed for {url}: {msg}"
-            logger.error(msg)
+            with self._lock:
+                self._stats['failed'] += 1
+                failure = self._registration_failed.get(url) or _Failure()
+                failure.failed(msg, self.BACKOFF_MIN, self.BACKOFF_MAX, self.BACKOFF_JITTER)
+                self._registration_failed[url] = failure
+            if failure.count == 1:
+                logger.error(msg)
+            else:
+                logger.debug(f"{msg} ({failure.count} failures)")
             raise ValueError(msg)
         device.max_age = max_age
         device.last_seen = time.monotonic()
-        self._devices[url] = device
+        with self._lock:
+            self._stats['registered'] += 1
+            self._registration_failed.pop(url, None)
+            self._devices[url] = device
+        self._publish()
         logger.info(f"registered {device.name} {device.uid} {url}")
 
+    def _reset_failures(self, urls):
+        with self._lock:
+            for url in urls:
+                if self._registration_failed.pop(url, None):
+                    logger.debug(f"retry {url}")
+
+    def _report(self, url, future):
+        e = future.exception()
+        if isinstance(e, (ValueError, RemoteError)):
+            failure = self._registration_failed.get(url)
+            if failure and failure.count > 1: return
+            # leave this print statement - will show up in jupyter!
+            print(f"\nFailed to register {url}:\n{e}\n")
+            logger.info(f"Failed to register {url}: {e}")
+        elif e:
+            logger.error(f"Failed to register {url}: {e}")
+
     def unregister(self, name:str):
         """Unregister device (by name, uid, or url)"""
-        url = None
-        for v in self._devices.values():
-            if name == v.uid or name == v.name or name == v.url:
-                url = v.url
-                break
-        if not url:
+        dev = next((v for v in self._snapshot.devices if name in (v.uid, v.name, v.url)), None)
+        if not dev:
             raise ValueError(f"Device '{name}' not in registry")
-        del self._devices[url]
-        logger.debug(f"unregisted '{url}'")
+        with self._lock:
+            self._devices.pop(dev.url, None)
+        self._publish()
+        logger.debug(f"unregisted '{dev.url}'")
+
+    def _publish(self):
+        # replace snapshot, notify listeners of added and removed devices
+        # listeners may block (e.g. zeroconf registration), call without holding _lock
+        with self._publish_lock:
+            with self._lock:
+                old = self._snapshot
+                new = _Snapshot(self._devices.values())
+                if new == old: return
+                self._snapshot = new
+                listeners = list(self._listeners)
+            for dev in old.devices - new.devices:
+                for listener in listeners:
+                    _notify(listener.unregister_device, dev.url)
+            for dev in new.devices - old.devices:
+                for listener in listeners:
+                    _notify(listener.register_device, dev.url, dev)
+
+
+# registration not required
+_DONE = Future()
+_DONE.set_result(None)
+
+
+class _Failure:
+    """Failed registrations of a url"""
+
+    def __init__(self):
+        self.count = 0
+        self.retry = 0
+        self.error = None
+
+    def failed(self, error, backoff_min, backoff_max, jitter):
+        self.count += 1
+        self.error = error
+        delay = min(backoff_max, backoff_min * 2**(self.count-1))
+        self.retry = time.monotonic() + delay * random.uniform(1-jitter, 1+jitter)
+
+
+class _Snapshot:
+    """Immutable set of devices, indexed by name, uid and url (each -> scheme -> device)"""
+
+    def __init__(self, devices=()):
+        self.devices = frozenset(devices)
+        self.by_name = {}
+        self.by_uid = {}
+        self.by_url = {}
+        for dev in self.devices:
+            self.by_name.setdefault(dev.name, {})[dev.scheme] = dev
+            self.by_uid.setdefault(dev.uid, {})[dev.scheme] = dev
+            self.by_url.setdefault(dev.url, {})[dev.scheme] = dev
+
+    def __eq__(self, other):
+        # names and uids may change (configuration, verification of cached identity)
+        return self.devices == other.devices and \
+            self.by_name.keys() == other.by_name.keys() and self.by_uid.keys() == other.by_uid.keys()
+
+
+def _notify(callback, *args):
+    try:
+        callback(*args)
+    except Exception as e:
+        logger.exception(f"listener {callback}: {e}")
 
 
 def find_device_class(url):
@@ -137,3 +449,34 @@ def find_device_class(url):
     c = classes.get(scheme)
     if c: return c
     raise ValueError(f"Unknown scheme: {scheme}")
+
+
+class _PrefixOutput:
+    """Prefix output lines with device name; lines of concurrent devices do not mix."""
+
+    def __init__(self, name, data_consumer, lock):
+        self._prefix = f"{name}: "
+        self._output = data_consumer
+        self._lock = lock
+        self._line = ''
+
+    def __call__(self, s):
+        self._line += s
+        if '\n' in self._line:
+            lines, self._line = self._line.rsplit('\n', 1)
+            with self._lock:
+                self._output(''.join(f"{self._prefix}{l}\n" for l in lines.split('\n')))
+
+    def flush(self):
+        if self._line:
+            self('\n')
+
+
+def _rsync_table(summaries):
+    lines = [ f"\n{'device':24} {'seconds':>8} {'files':>6} {'bytes':>10} {'sent':>10}  status\n" ]
+    for s in summaries:
+        r = s['result'] or {}
+        files = sum(r.get(k, 0) for k in ('added', 'updated', 'deleted'))
+        status = f"FAILED ({s['error']})" if s['error'] else 'ok'
+        lines.append(f"{s['name']:24} {s['seconds']:8.1f} {files:6} {r.get('size', 0):10} {r.get('sent', 0):10}  {status}\n")
+    return ''.join(lines)
@@ -1,17 +1,17 @@
 from .device_registry import DeviceRegistry
-from .certificate import create_key_cert_pair
+from .certificate import key_cert_file
 from .secrets import Secrets
 
 from zeroconf import ServiceInfo, Zeroconf
-from serial import SerialException
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+import asyncio
+import hmac
 import os
 import socket
-import selectors
 import ssl
 import threading
 import json
-import time
-import tempfile
 import logging
 
 logger = logging.getLogger(os.path.splitext(os.path.basename(__file__))[0])
@@ -36,7 +36,7 @@ class AdvertiseServer:
         info = ServiceInfo(
             type_="_repl._tcp.local.",
             name=device.name + "." + "_repl._tcp.local.",
-            port=Secrets.get_attr('server_port', '34567'),
+            port=Secrets.get('server_port', 34567, int),
             properties = { "uid": device.uid, "name": device.name },
             addresses=self._addresses)
         self._id2info[id] = info
@@ -54,149 +54,483 @@ class AdvertiseServer:
             pass
 
 
+class _Subscriber:
+    """Client of a _Hub.
+
+    Device output waits in a ring buffer of at most size bytes, the oldest
+    is dropped (and counted) when it overflows, except for the writer
+    whose output is limited by backpressure instead.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        # bytes of output lost, bytes of input discarded (not holding the writer token)
+        self.dropped = 0
+        self.ignored = 0
+        self.closed = False
+        # holds the writer token
+        self.writer = False
+        self._chunks = deque()
+        self._pending = 0
+        self._ready = asyncio.Event()
+        # cleared while more than half full, the hub waits for it if this is the writer
+        self.space = asyncio.Event()
+        self.space.set()
+
+    def put(self, data):
+        self._chunks.append(data)
+        self._pending += len(data)
+        while self._pending > self.size and not self.writer:
+            old = self._chunks.popleft()
+            self._pending -= len(old)
+            self.dropped += len(old)
+        if self._pending > self.size // 2:
+            self.space.clear()
+        self._ready.set()
+
+    def close(self):
+        self.closed = True
+        self.space.set()
+        self._ready.set()
+
+    async def get(self):
+        """List of outputs buffered since last call, None once the hub is closed."""
+        await self._ready.wait()
+        if not self._chunks:
+            return None
+        data = list(self._chunks)
+        self._chunks.clear()
+        self._pending = 0
+        self.space.set()
+        if not self.closed:
+            self._ready.clear()
+        return data
+
+
+class _Hub:
+    """One open connection to a device shared by any number of clients.
+
+    Device output is fanned out to all subscribers. Input is accepted only
+    from the subscriber holding the writer token, which passes to the
+    longest waiting writer when its holder leaves. Reading from the device
+    pauses while the ring buffer of the writer is more than half full,
+    output to other subscribers is dropped when theirs overflow.
+
+    The connection closes keep_warm seconds after the last subscriber
+    leaves, or when communication with the device fails.
+    """
+
+    def __init__(self, device, executor, coalesce_size, queue_chunks, keep_warm):
+        self.device = device
+        self.closed = False
+        # called once when closed, after the device is released
+        self.on_close = lambda: None
+        self._executor = executor
+        self._coalesce_size = coalesce_size
+        self._keep_warm = keep_warm
+        self._subscribers = set()
+        self._writer = None
+        self._waiting = deque()
+        self._queue = asyncio.Queue(queue_chunks)
+        self._tasks = []
+        self._idle_task = None
+        self._stop = threading.Event()
+        # thread reading devices without file descriptor
+        self._reader = None
+        # device output read by __enter__ past what it consumed
+        self._unread = b''
+        # set once closed and the device is released
+        self._done = asyncio.Event()
+        self.opened = asyncio.ensure_future(self._open())
+
+    def subscribe(self, write:bool, size:int) -> _Subscriber:
+        sub = _Subscriber(size)
+        self._subscribers.add(sub)
+        if self._unread:
+            sub.put(self._unread)
+            self._unread = b''
+        if write:
+            if self._writer is None:
+                self._writer = sub
+                sub.writer = True
+            else:
+                self._waiting.append(sub)
+        if self._idle_task:
+            self._idle_task.cancel()
+            self._idle_task = None
+        return sub
+
+    def unsubscribe(self, sub):
+        self._subscribers.discard(sub)
+        if sub in self._waiting:
+            self._waiting.remove(sub)
+        if sub is self._writer:
+            self._writer = self._waiting.popleft() if self._waiting else None
+            if self._writer:
+                self._writer.writer = True
+            # in case the hub waits for room in the ring of the former writer
+            sub.space.set()
+        if not self._subscribers and not self.closed:
+            self._idle_task = asyncio.ensure_future(self._close_idle())
+
+    async def write(self, sub, data):
+        if sub is self._writer:
+            await self._queue.put(data)
+        else:
+            sub.ignored += len(data)
+
+    async def close(self):
+        if self.closed: return
+        self.closed = True
+        self._stop.set()
+        try:
+            for sub in self._subscribers:
+                sub.close()
+            current = asyncio.current_task()
+            tasks = [ t for t in self._tasks + [ self._idle_task ] if t and t is not current ]
+            for t in tasks:
+                t.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            loop = asyncio.get_running_loop()
+            if self._reader:
+                # read_device returns within 0.5 seconds of _stop
+                await loop.run_in_executor(self._executor, self._reader.shutdown)
+            if self.opened.done() and not self.opened.exception():
+                logger.info(f"Closing connection to {self.device.uid}")
+                await loop.run_in_executor(self._executor, self.device.__exit__, None, None, None)
+        finally:
+            # only now may the device be opened again
+            self.on_close()
+            self._done.set()
+
+    async def wait_closed(self):
+        await self._done.wait()
+
+    async def _open(self):
+        loop = asyncio.get_running_loop()
+        try:
+            repl = await loop.run_in_executor(self._executor, self.device.__enter__)
+            # received while connecting but not consumed by the protocol, for the first client
+            unread = getattr(repl, 'unread', None)
+            self._unread = unread() if unread else b''
+        except BaseException:
+            self.closed = True
+            self.on_close()
+            self._done.set()
+            raise
+        self._tasks = [ asyncio.ensure_future(t()) for t in (self._queue_to_device, self._device_to_subscribers) ]
+        for t in self._tasks:
+            t.add_done_callback(self._task_done)
+        if not self._subscribers:
+            # clients that are about to subscribe cancel this
+            self._idle_task = asyncio.ensure_future(self._close_idle())
+
+    def _task_done(self, task):
+        if task.cancelled() or self.closed: return
+        if task.exception():
+            logger.info(f"Communication with {self.device.uid} failed, closing connection ({task.exception()})")
+        asyncio.ensure_future(self.close())
+
+    async def _close_idle(self):
+        await asyncio.sleep(self._keep_warm)
+        self._idle_task = None
+        if not self._subscribers:
+            await self.close()
+
+    async def _queue_to_device(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            chunks = [ await self._queue.get() ]
+            size = len(chunks[0])
+            # coalesce queued chunks into a single device write
+            while size < self._coalesce_size and not self._queue.empty():
+                chunks.append(self._queue.get_nowait())
+                size += len(chunks[-1])
+            data = chunks[0] if len(chunks) == 1 else b''.join(chunks)
+            await loop.run_in_executor(self._executor, self.device.write, data)
+
+    async def _device_to_subscribers(self):
+        loop = asyncio.get_running_loop()
+        device = self.device
+        # reused for the life of the connection
+        buf = memoryview(bytearray(self._coalesce_size))
+
+        def fill():
+            # read what is available, up to len(buf)
+            n = 0
+            while n < len(buf):
+                k = device.readinto(buf[n:])
+                if not k: break
+                n += k
+            return n
+
+        def read_device():
+            # blocking, returns 0 if closed
+            while not self._stop.is_set():
+                if device.wait_readable(0.5) or device.inWaiting():
+                    n = fill()
+                    if n: return n
+            return 0
+
+        async def publish(n):
+            # one copy shared by all subscribers
+            data = bytes(buf[:n])
+            for sub in self._subscribers:
+                sub.put(data)
+            # stop reading from the device while the writer is slow
+            while self._writer and not self._writer.space.is_set():
+                await self._writer.space.wait()
+
+        fd = device.fileno()
+        if fd is None:
+            # no file descriptor (or reads may block), wait for and read data in a
+            # thread of this hub, not the shared executor that idle hubs would exhaust
+            self._reader = ThreadPoolExecutor(1, thread_name_prefix=f'read-{device.uid}')
+            while True:
+                n = await loop.run_in_executor(self._reader, read_device)
+                if not n: return
+                await publish(n)
+        # forward data when the device descriptor becomes readable
+        readable = asyncio.Event()
+        loop.add_reader(fd, readable.set)
+        try:
+            while True:
+                readable.clear()
+                # also data buffered by the device (e.g. fifo), not just the descriptor
+                n = fill()
+                if n:
+                    await publish(n)
+                else:
+                    await readable.wait()
+        finally:
+            loop.remove_reader(fd)
+
+
 class DeviceServer():
+    """Serve devices in registry over TLS, one asyncio task per connection.
 
-    def __init__(self):
+    Protocol: after the TLS handshake the client sends
+        {"uid": uid, "password": password, "mode": "write" or "watch"}
+    (JSON, mode optional, default write) and the server answers b'ok' or
+    an error message. Then bytes are forwarded in both directions until
+    either side closes.
+
+    Clients of the same device share one connection to it (see _Hub) that
+    is kept open for KEEP_WARM seconds after the last client leaves. All
+    clients receive the device output, input is accepted from one writer
+    at a time. Watchers never send input.
+    Clients that reconnect should resume the TLS session of their previous
+    connection (e.g. ssl wrap_socket(..., session=previous.session)).
+    """
+
+    # seconds, for clients to complete the TLS handshake, send credentials
+    HANDSHAKE_TIMEOUT = 10
+    AUTH_TIMEOUT = 10
+    # maximum number of concurrent device sessions
+    MAX_SESSIONS = 32
+    # bytes per read from the client, bytes coalesced into one write to either side
+    READ_SIZE = 16*1024
+    COALESCE_SIZE = 64*1024
+    # client -> device chunks queued, bytes queued for the client before reading from the device pauses
+    QUEUE_CHUNKS = 16
+    CLIENT_BUFFER = 256*1024
+    # bytes of device output buffered per client, the oldest is dropped when a watcher falls behind
+    RING_SIZE = 1024*1024
+    # seconds a device connection stays open without clients
+    KEEP_WARM = 30
+    # TLS 1.3 session tickets issued per connection, for resumption
+    SESSION_TICKETS = 2
+
+    def __init__(self, registry):
         # serve devices in device_registry
+        self.__registry = registry
         self.__ip = _my_ip()
         self.__ssl_context = self.__make_ssl_context()
+        # blocking device calls (open, close, write); hubs that cannot select
+        # on the device read in a thread of their own, not from this pool
+        self.__executor = ThreadPoolExecutor(2*self.MAX_SESSIONS + 4, thread_name_prefix='device-server')
+        self.__sessions = 0
+        # device url -> _Hub
+        self.__hubs = {}
 
     def serve(self):
         """Serve multiple connections to different devices in parallel. Never returns."""
-        self.__sel = selectors.DefaultSelector()
-        lsock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        lsock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        port = Secrets.get_attr('server_port', '34567')
-        lsock.bind(('', port))
-        lsock.listen()
+        asyncio.run(self.serve_async())
+
+    async def serve_async(self):
+        port = Secrets.get('server_port', 34567, int)
+        server = await asyncio.start_server(self.__session, port=port, reuse_address=True,
+            ssl=self.__ssl_context, ssl_handshake_timeout=self.HANDSHAKE_TIMEOUT)
         logger.info(f"Listening for connections on {self.__ip}:{port}")
-        lsock.setblocking(False)
-        self.__sel.register(lsock, selectors.EVENT_READ, data=None)
-        while True:
-            try:
-                events = self.__sel.select(timeout=None)
-                for key, mask in events:
-                    if key.data is None:
-                        # connect request (key.fileobj is socket)
-                        self.__accept_wrapper(key.fileobj)
-                    else:
-                        # client connection
-                        self.__service_connection(key, mask)
-            except Exception as e:
-                logger.exception("unhandled exception")
-
-
-    def __accept_wrapper(self, sock):
-        # accept connection
-        conn, addr = sock.accept()
-        logger.debug(f"accept connection at {(conn, addr)}")
-        conn = self.__ssl_context.wrap_socket(conn, server_side=True)
-        # More quickly detect bad clients who quit without closing the
-        # connection: After 1 second of idle, start sending TCP keep-alive
-        # packets every 1 second. If 3 consecutive keep-alive packets
-        # fail, assume the client is gone and close the connection.
-        try:
-            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, 1)
-            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, 1)
-            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, 3)
-            conn.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
-        except AttributeError:
-            pass  # not available on windows
-        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
-        # get uid and password (blocking recv)
-        # TODO: check for incomplete message!
+        async with server:
+            await server.serve_forever()
+
+    async def __session(self, reader, writer):
+        # TLS handshake already completed by the event loop
+        addr = writer.get_extra_info('peername')
+        logger.debug(f"accept connection from {addr}")
+        _set_keepalive(writer.get_extra_info('socket'))
+        loop = asyncio.get_running_loop()
+        device = None
         try:
-            uid_pwd = json.loads(conn.recv(1024).decode())
-        except ssl.SSLWantReadError:
-            logger.error("SSLWantReadError in device_server.__accept_wrapper")
-        except (ConnectionResetError, Exception):
-            conn.close()
-            return
-        uid = uid_pwd.get('uid', '?')
-        device = DeviceRegistry.get_device(uid)
-        logger.debug(f"Request from {addr} to {uid}")
-        # check password & device status
-        ans = None
-        if uid_pwd.get('password') != Secrets.get_attr('password', '?'):
-            ans = f'wrong password for {uid}'
-        elif not device:
-            ans = f'no device {uid}'
-        if ans:
-            conn.write(ans.encode())
-            conn.close()
-        else:
-            conn.write(b'ok')
-            conn.setblocking(False)
-            device.__enter__()
-            events = selectors.EVENT_READ | selectors.EVENT_WRITE
-            self.__sel.register(conn, events, data=device)
+            # get uid and password
+            try:
+                uid_pwd = await asyncio.wait_for(_read_json(reader), self.AUTH_TIMEOUT)
+            except (asyncio.TimeoutError, ValueError, UnicodeError, ConnectionError, ssl.SSLError) as e:
+                logger.info(f"no credentials from {addr}: {e!r}")
+                return
+            uid = uid_pwd.get('uid', '?')
+            mode = uid_pwd.get('mode', 'write')
+            logger.debug(f"Request from {addr} to {uid} ({mode})")
+            # check password & device status
+            ans = None
+            if not hmac.compare_digest(str(uid_pwd.get('password')), Secrets.get('password', '?', str)):
+                ans = f'wrong password for {uid}'
+            elif not mode in ('write', 'watch'):
+                ans = f'unknown mode {mode}'
+            elif self.__sessions >= self.MAX_SESSIONS:
+                ans = f'too many connections'
+            else:
+                device = await loop.run_in_executor(self.__executor, self.__registry.get_device, uid)
+                if not device:
+                    ans = f'no device {uid}'
+            if ans:
+                writer.write(ans.encode())
+                await writer.drain()
+                return
+            self.__sessions += 1
+            try:
+                try:
+                    hub = await self.__hub(device)
+                except Exception as e:
+                    logger.info(f"Cannot connect to {uid}: {e}")
+                    writer.write(f'cannot connect to {uid}: {e}'.encode())
+                    await writer.drain()
+                    return
+                writer.write(b'ok')
+                await writer.drain()
+                await self.__forward(hub, reader, writer, mode == 'write')
+            finally:
+                self.__sessions -= 1
+        except Exception as e:
+            logger.exception(f"session {addr}: {e}")
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except (ConnectionError, ssl.SSLError):
+                pass
+
+    async def __hub(self, device):
+        # open connection to device or share the one that is open
+        hub = self.__hubs.get(device.url)
+        while hub is not None and hub.closed:
+            # previous connection is closing, do not reopen the device before it is released
+            await hub.wait_closed()
+            hub = self.__hubs.get(device.url)
+        if hub is None:
+            hub = _Hub(device, self.__executor, self.COALESCE_SIZE, self.QUEUE_CHUNKS, self.KEEP_WARM)
+            self.__hubs[device.url] = hub
+            hub.on_close = lambda: self.__hubs.pop(device.url, None) if self.__hubs.get(device.url) is hub else None
+        # shielded, other clients may be waiting for the same hub
+        await asyncio.shield(hub.opened)
+        return hub
+
+    async def __forward(self, hub, reader, writer, write):
+        # forward data in both directions until either side closes
+        # pause forwarding to this client (and the hub, if it holds the writer token)
+        # while this much is unsent to the client
+        writer.transport.set_write_buffer_limits(high=self.CLIENT_BUFFER)
+        sub = hub.subscribe(write, self.RING_SIZE)
+
+        async def client_to_device():
+            while True:
+                data = await reader.read(self.READ_SIZE)
+                if not data: return
+                await hub.write(sub, data)
 
-    def __service_connection(self, key, mask):
+        async def device_to_client():
+            while True:
+                data = await sub.get()
+                if data is None: return
+                writer.writelines(data)
+                await writer.drain()
+
+        tasks = [ asyncio.ensure_future(client_to_device()), asyncio.ensure_future(device_to_client()) ]
         try:
-            sock = key.fileobj
-            device = key.data
-            if mask & selectors.EVENT_READ:
-                # debug code for dealing with SSLWantReadError
-                # from Python docs:
-                #    exception ssl.SSLWantReadError
-                #    A subclass of SSLError raised by a non-blocking SSL socket when
-                #    trying to read or write data, but more data needs to be received
-                #    on the underlying TCP transport before the request can be fulfilled.
-                for _ in range(10):
-                    try:
-                        recv_data = sock.recv(256)
-                        break
-                    except ssl.SSLWantReadError:
-                        logger.warning("SSLWantReadError in device_server.__service_connection")
-                        time.sleep(0.5)
-                if recv_data:
-                    device.write(recv_data)
-                else:
-                    logger.info(f"Closing connection to {device.uid}")
-                    self.__sel.unregister(sock)
-                    sock.close()
-                    device.__exit__(None, None, None)
-            if mask & selectors.EVENT_WRITE:
-                # forward data from device, if any
-                msg = device.read_all()
-                if len(msg) > 0:
-                    sock.sendall(msg)
-        except (SerialException, ConnectionResetError, OSError) as e:
-            logger.info(f"Communication with {device.uid} failed, closing connection ({e})")
-            self.__sel.unregister(sock)
-            sock.close()
-            device.__exit__(None, None, None)
-
-    @staticmethod
-    def __make_ssl_context():
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for t in done:
+                if t.exception():
+                    logger.info(f"Communication with {hub.device.uid} failed, closing connection ({t.exception()})")
+        finally:
+            for t in tasks:
+                t.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            hub.unsubscribe(sub)
+            if sub.dropped or sub.ignored:
+                logger.info(f"{hub.device.uid}: {sub.dropped} bytes of output dropped, {sub.ignored} bytes of input ignored")
+
+    def __make_ssl_context(self):
         context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
-        with tempfile.NamedTemporaryFile() as cert_file:
-            key, cert = create_key_cert_pair()
-            cert_file.write(key)
-            cert_file.write(cert)
-            cert_file.seek(0)
-            context.load_cert_chain(certfile=cert_file.name)
+        # generated once, then reused across restarts
+        context.load_cert_chain(certfile=key_cert_file())
         context.options |= ssl.OP_NO_TLSv1 | ssl.OP_NO_TLSv1_1
+        # clients that reconnect (e.g. for every notebook cell) resume the session
+        # with a ticket instead of a full handshake; valid while the server runs
+        context.options &= ~ssl.OP_NO_TICKET
+        context.num_tickets = self.SESSION_TICKETS
         context.set_ciphers('EECDH+AESGCM:EDH+AESGCM:AES256+EECDH:AES256+EDH')
         return context
 
 
+async def _read_json(reader, limit=1024):
+    # read JSON object sent by client, possibly in several segments
+    buf = b''
+    while True:
+        data = await reader.read(limit - len(buf))
+        if not data:
+            raise ConnectionError("closed by client")
+        buf += data
+        try:
+            msg = json.loads(buf.decode())
+        except ValueError:
+            if len(buf) >= limit: raise
+            continue
+        if not isinstance(msg, dict):
+            raise ValueError(f"expected JSON object, got {msg!r}")
+        return msg
+
+def _set_keepalive(sock):
+    # More quickly detect bad clients who quit without closing the
+    # connection: After 1 second of idle, start sending TCP keep-alive
+    # packets every 1 second. If 3 consecutive keep-alive packets
+    # fail, assume the client is gone and close the connection.
+    if sock is None: return
+    try:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, 1)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, 1)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, 3)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    except (AttributeError, OSError):
+        pass  # not available on windows
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+
 ##########################################################################
 # Main
 
 def main():
-    from .discover_serial import DiscoverSerial
     import sys
 
     logging.basicConfig()
     logging.getLogger('device_server').setLevel(logging.INFO)
 
     # scan serial ports and advertise
-    DiscoverSerial()
-    DeviceRegistry.register_listener(AdvertiseServer())
+    registry = DeviceRegistry()
+    registry.register_listener(AdvertiseServer())
 
     # accept connections and device communication
-    DeviceServer().serve()
+    DeviceServer(registry).serve()
 
 
 if __name__ == "__main__":
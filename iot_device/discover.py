@@ -10,3 +10,11 @@ class Discover(ABC):
     @abstractmethod
     def scan(self) -> list:
         """url's of devices that are online"""
+
+    def hint(self, url:str) -> str:
+        """Identifies device at url found by last scan (see IdentityCache), None if unknown"""
+        return None
+
+    def info(self, url:str) -> dict:
+        """Metadata advertised by device at url, e.g. uid, implementation, platform"""
+        return {}
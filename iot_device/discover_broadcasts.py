@@ -7,6 +7,25 @@ import socket, threading, os, time, logging
 
 logger = logging.getLogger(os.path.splitext(os.path.basename(__file__))[0])
 
+"""Advertisement format (UDP datagram, lines separated by \\n):
+
+    url
+    uid
+    key=value    (optional, any number)
+
+Keys sent by devices (all optional):
+    implementation   sys.implementation.name
+    platform         sys.platform
+    mem_free         free memory (bytes)
+    generation       incremented by the device when its file system changes
+"""
+
+# maximum size of an advertisement
+MAX_ADVERTISEMENT = 1024
+
+# integer valued keys
+_INT_KEYS = { 'mem_free', 'generation' }
+
 
 class DiscoverBroadcasts(Discover):
 
@@ -14,34 +33,71 @@ class DiscoverBroadcasts(Discover):
         """Start a daemon thread that collects advertisements and discards them after max_age seconds."""
         super().__init__()
         self._lock = _lock = Lock()
+        # url -> time of last advertisement
         self._urls = _urls = dict()
+        # url -> advertised info (uid, ...)
+        self._info = _info = dict()
         self._max_age = max_age
 
         def scanner():
-            nonlocal _urls, _lock
+            nonlocal _urls, _info, _lock
             client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
             # see https://stackoverflow.com/questions/14388706
             client.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
             client.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-            client.bind(("", Secrets.get_attr('broadcast_port', 50000)))
+            # room for bursts, e.g. when many devices power up together
+            client.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 256*1024)
+            client.bind(("", Secrets.get('broadcast_port', 50000, int)))
             try:
                 while True:
-                    data, addr = client.recvfrom(256)
+                    # wait for an advertisement, then read all that are queued
+                    client.setblocking(True)
+                    batch = [ client.recvfrom(MAX_ADVERTISEMENT) ]
+                    client.setblocking(False)
                     try:
-                        url, uid = data.split(b'\n')
-                        # TODO: discard devices without device_config
-                        with _lock:
-                            _urls[url.decode()] = time.monotonic()
-                    except (AttributeError, ValueError):
-                        logger.DEBUG(f"received malformed advertisement {data} from {addr}")
+                        while len(batch) < 256:
+                            batch.append(client.recvfrom(MAX_ADVERTISEMENT))
+                    except BlockingIOError:
+                        pass
+                    now = time.monotonic()
+                    with _lock:
+                        for data, addr in batch:
+                            try:
+                                url, info = parse_advertisement(data)
+                            except (UnicodeError, ValueError):
+                                logger.debug(f"received malformed advertisement {data} from {addr}")
+                                continue
+                            _urls[url] = now
+                            _info[url] = info
             finally:
                 client.close()
 
 
-        self._thread = Thread(target=scanner)
+        self._thread = Thread(target=scanner, daemon=True)
         self._thread.start()
 
     def scan(self):
         with self._lock:
             # set of urls seen in last _max_age seconds
-            return { url for url, t in self._urls.items() if (time.monotonic()-t) < self._max_age }
\ No newline at end of file
+            return { url for url, t in self._urls.items() if (time.monotonic()-t) < self._max_age }
+
+    def hint(self, url):
+        with self._lock:
+            return self._info.get(url, {}).get('uid')
+
+    def info(self, url):
+        with self._lock:
+            return dict(self._info.get(url, {}))
+
+
+def parse_advertisement(data:bytes):
+    """Return url, dict with uid and optional keys. Raises ValueError if malformed."""
+    url, uid, *lines = data.decode().strip().split('\n')
+    if not '://' in url or not uid.strip():
+        raise ValueError(f"malformed advertisement {data}")
+    info = { 'uid': uid.strip() }
+    for line in lines:
+        key, _, value = line.strip().partition('=')
+        if not key: continue
+        info[key] = int(value) if key in _INT_KEYS else value
+    return url.strip(), info
@@ -1,64 +1,79 @@
 from .discover import Discover
 
-from zeroconf import Zeroconf, ServiceBrowser, ServiceStateChange
-import os, socket, logging, time
+from zeroconf import IPVersion, ServiceStateChange, InterfaceChoice
+from zeroconf.asyncio import AsyncZeroconf, AsyncServiceBrowser, AsyncServiceInfo
+import asyncio, os, threading, logging
 
 logger = logging.getLogger(os.path.splitext(os.path.basename(__file__))[0])
 
 
 class DiscoverMdns(Discover):
-    """zeroconf device discovery"""
+    """zeroconf device discovery
 
-    def __init__(self, scan_rate:float=5):
+    A single browser, started once, runs in an asyncio event loop in a
+    daemon thread and keeps the set of urls up to date as services are
+    announced, updated and removed. The browser tracks the TTL of the
+    records and goodbye packets, services are dropped when it reports
+    them removed.
+    """
+
+    SERVICE_TYPES = [ "_mp._tcp.local.", "_ws._tcp.local.", "_telnet._tcp.local." ]
+
+    def __init__(self, interfaces=InterfaceChoice.All):
+        """interfaces: passed to Zeroconf, e.g. ['127.0.0.1'] for testing"""
         super().__init__()
+        self._interfaces = interfaces
+        self._lock = threading.Lock()
+        # service name -> (url, uid)
+        self._services = {}
+        self._aiozc = None
+        self._loop = asyncio.new_event_loop()
+        threading.Thread(target=self._loop.run_forever, name='mdns', daemon=True).start()
+        asyncio.run_coroutine_threadsafe(self._start(), self._loop)
+
+    def close(self):
+        """Stop browsing"""
+        if self._aiozc:
+            asyncio.run_coroutine_threadsafe(self._aiozc.async_close(), self._loop).result(5)
+        self._loop.call_soon_threadsafe(self._loop.stop)
 
     def scan(self):
         # return url's of devices that are online
-        self.urls = set()
-        if False:
-            # asyncio ... task exception error (see below)
-            zc = Zeroconf()
-            try:
-                ServiceBrowser(zc, "_mp._tcp.local.", self)
-                ServiceBrowser(zc, "_ws._tcp.local.", self)
-                ServiceBrowser(zc, "_telnet._tcp.local.", self)
-                # give the scanner some time to find everything ...
-                time.sleep(1)
-            except Exception as ex:
-                print(ex)
-                logger.exception(f"Unhandled exception in DiscoverMdns._scanner")
-            finally:
-                zc.close()
-        return self.urls
+        with self._lock:
+            return { url for url, _ in self._services.values() }
 
-    def _url(self, zeroconf, service_type, name):
-        info = zeroconf.get_service_info(service_type, name)
-        if info == None: return
-        ip = socket.inet_ntoa(info.addresses[0])
-        port = info.port
-        scheme = service_type.split('.')[0][1:]
-        url = f"{scheme}://{ip}:{port}"
-        return url
+    def hint(self, url):
+        with self._lock:
+            for u, uid in self._services.values():
+                if u == url: return uid
 
-    def add_service(self, zeroconf, service_type, name):
-        self.urls.add(self._url(zeroconf, service_type, name))
+    async def _start(self):
+        try:
+            self._aiozc = AsyncZeroconf(interfaces=self._interfaces)
+            self._browser = AsyncServiceBrowser(self._aiozc.zeroconf, self.SERVICE_TYPES,
+                handlers=[ self._on_change ])
+        except Exception as e:
+            logger.exception(f"mdns browser: {e}")
 
-    def update_service(self, zeroconf, service_type, name):
-        self.add_service(zeroconf, service_type, name)
+    def _on_change(self, zeroconf, service_type, name, state_change):
+        # called by browser in event loop
+        if state_change is ServiceStateChange.Removed:
+            logger.debug(f"removed {name}")
+            with self._lock:
+                self._services.pop(name, None)
+        else:
+            asyncio.ensure_future(self._resolve(zeroconf, service_type, name))
 
-    def remove_service(self, zeroconf, service_type, name):
-        pass
-
-
-"""
-13.07.21 17:02:20 (-0700)  jupyter  ERROR:asyncio:Task exception was never retrieved
-13.07.21 17:02:20 (-0700)  jupyter  future: <Task finished name='Task-1' coro=<AsyncEngine._async_setup() done, defined at /usr/local/lib/python3.8/site-packages/zeroconf/_core.py:104> exception=OSError(9, 'Bad file descriptor')>
-13.07.21 17:02:20 (-0700)  jupyter  Traceback (most recent call last):
-13.07.21 17:02:20 (-0700)  jupyter    File "/usr/local/lib/python3.8/site-packages/zeroconf/_core.py", line 107, in _async_setup
-13.07.21 17:02:20 (-0700)  jupyter      await self._async_create_endpoints()
-13.07.21 17:02:20 (-0700)  jupyter    File "/usr/local/lib/python3.8/site-packages/zeroconf/_core.py", line 133, in _async_create_endpoints
-13.07.21 17:02:20 (-0700)  jupyter      transport, protocol = await loop.create_datagram_endpoint(lambda: AsyncListener(self.zc), sock=s)
-13.07.21 17:02:20 (-0700)  jupyter    File "/usr/local/lib/python3.8/asyncio/base_events.py", line 1231, in create_datagram_endpoint
-13.07.21 17:02:20 (-0700)  jupyter      sock.setblocking(False)
-13.07.21 17:02:20 (-0700)  jupyter  OSError: [Errno 9] Bad file descriptor
-"""
\ No newline at end of file
+    async def _resolve(self, zeroconf, service_type, name):
+        info = AsyncServiceInfo(service_type, name)
+        if not await info.async_request(zeroconf, 3000):
+            logger.debug(f"cannot resolve {name}")
+            return
+        addresses = info.parsed_addresses(IPVersion.V4Only)
+        if not addresses: return
+        scheme = service_type.split('.')[0][1:]
+        url = f"{scheme}://{addresses[0]}:{info.port}"
+        uid = info.properties.get(b'uid')
+        with self._lock:
+            self._services[name] = (url, uid.decode() if uid else None)
+        logger.debug(f"found {url} ({name})")
@@ -24,13 +24,23 @@ class DiscoverSerial(Discover):
     def __init__(self, scan_rate:float=1):
         """Start a daemon thread that continually scans ports every scan_rate seconds."""
         super().__init__()
+        # url -> vid:pid:serial_number
+        self._hints = {}
 
     def scan(self):
         # return url's of devices that are online
         res = set()
+        hints = {}
         for port in serial.tools.list_ports.comports():
             if port.vid in COMPATIBLE_VID:
-                res.add(f"serial://{port.device}")
+                url = f"serial://{port.device}"
+                res.add(url)
+                if port.serial_number:
+                    hints[url] = f"{port.vid:04x}:{port.pid:04x}:{port.serial_number}"
             elif port.vid:
                 logger.info(f"Found {port} with unknown VID {port.vid:02X} (ignored)")
+        self._hints = hints
         return res
+
+    def hint(self, url):
+        return self._hints.get(url)
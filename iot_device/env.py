@@ -11,6 +11,7 @@ Environment Variables
 * IOT_DEVICES   $IOT_PROJECTS/devices
 * IOT_LIBS      $IOT_PROJECTS/libs
 * IOT_SECRETS   $IOT_LIBS/secrets.py
+* IOT_CACHE     ~/.cache/iot-device
 """
 
 class Env:
@@ -35,12 +36,17 @@ class Env:
     def iot_secrets():
         return os.getenv('IOT_SECRETS', os.path.join(Env.iot_libs(), 'secrets.py'))
     
+    @staticmethod
+    def iot_cache():
+        return os.getenv('IOT_CACHE', '~/.cache/iot-device')
+
     @staticmethod
     def print_config():
         print("IOT_PROJECTS:", Env.iot_projects())
         print("IOT_DEVICES: ", Env.iot_devices())
         print("IOT_LIBS:    ", Env.iot_libs())
         print("IOT_SECRETS: ", Env.iot_secrets())
+        print("IOT_CACHE:   ", Env.iot_cache())
 
 # ensure this is defined ...
 
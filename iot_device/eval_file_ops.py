@@ -1,28 +1,39 @@
 from .eval import Eval, RemoteError
-import logging, time, os, io, ast
+from .remote_lib import HELPERS, VERSION as HELPERS_VERSION
+from binascii import Error as BinasciiError
+from base64 import b64decode
+import logging, time, os, io, ast, zlib
 
 
 logger = logging.getLogger(os.path.splitext(os.path.basename(__file__))[0])
 
+# deflate window for compressed transfers (mcu needs 2**ZLIB_WBITS bytes)
+ZLIB_WBITS = 10
+
 
 class EvalFileOps(Eval):
     """Add file system operations"""
 
+    def __init__(self, device):
+        super().__init__(device)
+        # new connection, check helpers on mcu before first use
+        device.helpers_version = None
+
     def makedirs(self, path:str):
         """Make all directories required for path. No-op if directories exist."""
-        self._remote_exec(f"makedirs({repr(path)})", _makedirs_func)
+        self._remote_exec(f"makedirs({repr(path)})")
 
     def rm_rf(self, path:str, r:bool=True, f:bool=True):
         """rm -rf path"""
-        self._remote_exec(f"rm_rf({repr(path)}, {repr(r)}, {repr(f)})", _rm_rf_func)
+        self._remote_exec(f"rm_rf({repr(path)}, {repr(r)}, {repr(f)})")
 
     def cat(self, path:str, data_consumer=None):
         """Show contents of path on console"""
-        return self._remote_exec(f"cat({repr(path)})", _cat_func, data_consumer=data_consumer)
+        return self._remote_exec(f"cat({repr(path)})", data_consumer=data_consumer)
 
     def get_time(self):
         """Get struct time from mcu"""
-        st = self._remote_exec(f"get_time()", _time_funcs)
+        st = self._remote_exec(f"get_time()")
         if not st:
             raise RemoteError(f"Cannot read time from {self.device.name}")
         st = eval(st.decode())
@@ -32,10 +43,52 @@ class EvalFileOps(Eval):
 
     def sync_time(self, tolerance:float=5):
         """Synchronize mcu time to host if they differ by more than tolerance seconds"""
-        self._remote_exec(f"set_time({tuple(time.localtime())}, {tolerance})", _time_funcs)
-
-    def fget(self, mcu_file:str, host_file:str, chunk_size:int=256, data_consumer=None):
-        """Copy from microcontroller to host"""
+        self._remote_exec(f"set_time({tuple(time.localtime())}, {tolerance})")
+
+    def compression(self):
+        """Return (module, can_compress) for file transfers.
+        module is the deflate implementation on the mcu ('deflate', 'zlib' or '').
+        Probed once and cached on the device.
+        """
+        if self.device.compression is None:
+            res = self._remote_exec("print(*zlib_info)").decode().split()
+            module, can_compress = res if len(res) == 2 else ('-', '0')
+            self.device.compression = (module.strip('-'), can_compress == '1')
+            logger.debug(f"compression {self.device.compression}")
+        return self.device.compression
+
+    def fget(self, mcu_file:str, host_file:str, chunk_size:int=0, data_consumer=None):
+        """Copy from microcontroller to host.
+        The file is streamed in base64 encoded frames with a single exec,
+        compressed if supported by the mcu. Falls back to one exec per chunk
+        on ports without binascii.
+        chunk_size: bytes per frame, 0 to adapt to free memory on the mcu.
+        Returns the number of (compressed) bytes transferred.
+        """
+        if not self._transfer_info()[0]:
+            return self._fget_chunked(mcu_file, host_file, chunk_size or 256, data_consumer)
+        wbits = ZLIB_WBITS if self.compression()[1] else 0
+        with open(host_file, 'wb') as f:
+            out = FgetOutput(f, data_consumer)
+            self._remote_exec(f"fget({repr(mcu_file)}, {chunk_size}, {wbits})",
+                data_consumer=out.data_consumer, timeout=10)
+        if out.error:
+            raise RemoteError(f"fget {mcu_file}: {out.error}")
+        if not out.done:
+            raise RemoteError(f"fget {mcu_file}: incomplete transfer ({out.size} bytes received)")
+        return out.sent
+
+    def _transfer_info(self):
+        # (stream_fget, stream_fput), probed once and cached on the device
+        if self.device.stream_fget is None:
+            res = self._remote_exec("transfer_info()").decode().split()
+            b64, stdin = res if len(res) == 2 else ('0', '0')
+            self.device.stream_fget = b64 == '1'
+            self.device.stream_fput = b64 == '1' and stdin == '1'
+            logger.debug(f"stream_fget {self.device.stream_fget}, stream_fput {self.device.stream_fput}")
+        return self.device.stream_fget, self.device.stream_fput
+
+    def _fget_chunked(self, mcu_file, host_file, chunk_size, data_consumer):
         self.exec(f"f=open('{mcu_file}', 'rb')\nr=f.read")
         with open(host_file, 'wb') as f:
             n = 1
@@ -55,11 +108,13 @@ class EvalFileOps(Eval):
                     data_consumer('.')
                 n += 1
         self.exec("f.close()")
+        return os.path.getsize(host_file)
 
     def fput(self, host_file:str, mcu_file:str, chunk_size:int=256, data_consumer=None):
-        """Copy from host to microcontroller"""
+        """Copy from host to microcontroller.
+        Returns the number of bytes transferred."""
         self.makedirs(os.path.dirname(mcu_file))
-        if not os.path.isfile(host_file): return
+        if not os.path.isfile(host_file): return 0
         self.exec(f"f=open('{mcu_file}','wb')\nw=f.write")
         with open(host_file, 'rb') as f:
             n = 1
@@ -71,87 +126,114 @@ class EvalFileOps(Eval):
                 n += 1
                 self.exec(f"w({repr(data)})")
         self.exec("f.close()")
-
-    def _remote_exec(self, code:str, func:str, data_consumer=None, timeout=3) -> bytes:
-        """Execute code on remote; upload code if required"""
+        return os.path.getsize(host_file)
+
+    def fput_bundle(self, files, chunk_size:int=256, data_consumer=None):
+        """Copy list of (host_file, mcu_file) to microcontroller.
+        Returns (bytes transferred, dict mcu_file -> error message)."""
+        sent = 0
+        errors = {}
+        for host_file, mcu_file in files:
+            try:
+                sent += self.fput(host_file, mcu_file, chunk_size, data_consumer) or 0
+            except RemoteError as e:
+                errors[mcu_file] = str(e)
+        return sent, errors
+
+    def mem_free(self) -> int:
+        """Free memory on mcu (after garbage collection)"""
+        return int(self.exec("import gc\ngc.collect()\nprint(gc.mem_free())"))
+
+    def _remote_exec(self, code:str, data_consumer=None, timeout=3) -> bytes:
+        """Execute code on remote in namespace of helper library (remote_lib)"""
+        logger.debug(f"_remote_exec({code})")
+        return self._with_helpers(lambda:
+            self.exec(f"exec({repr(code)}, __iot49__)", data_consumer=data_consumer, timeout=timeout))
+
+    def _with_helpers(self, run):
+        """run() with the helper library on the mcu. If it is gone without a
+        reset through this connection (e.g. machine.soft_reset() in user code),
+        upload it again and retry once."""
+        self._upload_helpers()
         try:
-            logger.debug(f"_remote_exec({code})")
-            return self.exec(f"exec({repr(code)}, __iot49__)", data_consumer=data_consumer, timeout=timeout)
-        except (RemoteError, OSError):
-            # upload __iot49__ and try again
-            logger.debug(f"_remote_exec: upload {func}")
-            self.exec("if not '__iot49__' in globals(): __iot49__ = {}")
-            self.exec(f"exec({repr(func)}, __iot49__)")
-            logger.debug("_remote_exec: 2nd try")
-            return self.exec(f"exec({repr(code)}, __iot49__)", data_consumer=data_consumer, timeout=timeout)
+            return run()
+        except RemoteError as e:
+            msg = str(e)
+            if not ('NameError' in msg and '__iot49__' in msg): raise
+            logger.debug(f"helpers lost on {self.device}, uploading again")
+            self.device.helpers_version = None
+            self._upload_helpers()
+            return run()
+
+    def _upload_helpers(self):
+        """Upload helper library unless the mcu already has this version.
+        Checked once per connection and after resets."""
+        if self.device.helpers_version == HELPERS_VERSION:
+            return
+        ver = self.exec("print(globals().get('__iot49__', {}).get('__ver__'))").decode().strip()
+        if ver != HELPERS_VERSION:
+            logger.debug(f"upload helpers {HELPERS_VERSION} ({len(HELPERS)} bytes), mcu has {ver}")
+            self.exec("__iot49__ = {}")
+            self.exec(f"exec({repr(HELPERS)}, __iot49__)", timeout=10)
+        self.device.helpers_version = HELPERS_VERSION
 
 
 ###############################################################################
-# code snippets (run on remote)
-
-_makedirs_func = """
-import os
-def makedirs(path):
-    try:
-        os.mkdir(path)
-    except OSError as e:
-        if e.args[0]==2:
-            makedirs(path[:path.rfind('/')])
-            os.mkdir(path)
-        elif e.args[0]==17:
-            pass
-        else:
-            raise
-"""
-
-_rm_rf_func = """
-import os
-def rm_rf(path, r, f):
-    try:
-        mode = os.stat(path)[0]
-    except OSError:
-        return
-    if mode & 0x4000 != 0:
-        if r:
-            for file in os.listdir(path):
-                rm_rf(path + '/' + file, r, f)
-        if f:
-            try:
-                os.rmdir(path)
-            except OSError:
-                pass
-    else:
-        os.remove(path)
-"""
-
-_cat_func = """
-def cat(path):
-    with open(path) as f:
+# Collect output from fget (remote_lib)
+
+class FgetOutput:
+    """Decode frames sent by fget on the mcu and write them to file.
+
+    Frame format (one per line):
+        kind,size,crc32,base64-data
+        E                        end of file
+    kind is b (plain) or z (raw deflate, ZLIB_WBITS), size and crc32 refer
+    to the uncompressed data. crc32 is -1 if not available on the mcu.
+    """
+
+    def __init__(self, file, data_consumer=None):
+        self._file = file
+        self._output = data_consumer
+        self._buffer = bytearray()
+        self.frames = 0
+        self.size = 0
+        self.sent = 0
+        self.done = False
+        self.error = None
+
+    def data_consumer(self, b):
+        # b could be any fragment or combination of lines!
+        buf = self._buffer
+        buf += b.replace(b'\x04', b'')
+        start = 0
         while True:
-            line = f.readline()
-            if not line:
-                break
-            print(line, end="")
-"""
-
-_time_funcs = """
-import time
-def get_time():
-    print(tuple(time.localtime()), end="")
-
-def set_time(st, tolerance=5):
-    host  = time.mktime(st)
-    local = time.time()
-    # delete this comment, stops working with ws
-    if abs(host-local) < tolerance:
-        return
-    try:
-        import rtc
-        rtc.RTC().datetime = st
-    except ImportError:
-        import machine as m
-        st = list(st)
-        st.insert(3, st[6])
-        st[7] = 0
-        m.RTC().datetime(st[:8])
-"""
+            end = buf.find(b'\n', start)
+            if end < 0: break
+            if not self.error:
+                self._frame(bytes(buf[start:end]).rstrip(b'\r'))
+            start = end + 1
+        del buf[:start]
+
+    def _frame(self, line):
+        if line == b'E':
+            self.done = True
+            return
+        try:
+            kind, size, crc, data = line.split(b',', 3)
+            size, crc = int(size), int(crc)
+            # reject any non-base64 characters, crc32 may not be available
+            data = b64decode(data, validate=True)
+            self.sent += len(data)
+            if kind == b'z':
+                data = zlib.decompress(data, -ZLIB_WBITS)
+        except (ValueError, BinasciiError, zlib.error) as e:
+            self.error = f"malformed frame {self.frames}: {e}"
+            return
+        if len(data) != size or (crc >= 0 and zlib.crc32(data) != crc):
+            self.error = f"frame {self.frames} corrupted"
+            return
+        self._file.write(data)
+        self.frames += 1
+        self.size += len(data)
+        if self._output and self.frames % 4 == 0:
+            self._output('.')
@@ -10,18 +10,33 @@ logger = logging.getLogger(os.path.splitext(os.path.basename(__file__))[0])
 class EvalRlist(EvalFileOps):
     """Add file listing capabilities"""
 
-    def rlist(self, path='/', data_consumer=None, show=False):
-        """Return and optionally display files stored on remote"""
-        out = RlistOutput(data_consumer, show)
+    def rlist(self, path='/', data_consumer=None, show=False, mtime=True):
+        """Return and optionally display files stored on remote.
+        mtime=False skips stat calls for files on the mcu (their mtimes
+        reported as 0) on ports where os.ilistdir reports the file size."""
+        out = RlistOutput(path, data_consumer, show)
         try:
-            self._remote_exec(f"rlist({repr(path)})", _rlist_func, data_consumer=out.data_consumer)
+            self._remote_exec(f"rlist({repr(path)}, {mtime})", data_consumer=out.data_consumer)
         except RemoteError as e:
             raise
         return out.files
 
+    def rstat(self, paths, batch=200):
+        """Return dict path -> (mtime, size) for paths that exist on remote.
+        size is -1 for directories."""
+        result = {}
+        for i in range(0, len(paths), batch):
+            chunk = paths[i:i+batch]
+            res = self._remote_exec(f"rstat({repr(chunk)})", timeout=10)
+            for path, line in zip(chunk, res.decode().split()):
+                if line == '-': continue
+                mtime, size = line.split(',')
+                result[path] = (int(TZ.local2gmtime(int(mtime))), int(size))
+        return result
+
 
 ###############################################################################
-# Collect output from _mcu_list
+# Collect output from rlist (remote_lib)
 
 class TZ:
     # convert micropython localtime (e.g. mtime) to gmtime
@@ -39,83 +54,69 @@ class TZ:
 
 
 class RlistOutput(TZ):
+    """Parse output of rlist on the mcu.
+
+    One line per entry (path is last so it may contain spaces):
+        D -1 mtime path     folder, full path
+        F size mtime name   file in last folder (full path if no folder yet)
+    """
 
-    def __init__(self, data_consumer=None, show=False):
+    def __init__(self, root='/', data_consumer=None, show=False):
         # show: prints file list to output
         # (otherwise just progress, if output not None)
         self._output = data_consumer
         self._show = show
-        self._level_offset = 0
-        self._path_stack = []
+        self._root_level = self._level(root)
+        self._dir = None
+        self._dir_level = 0
         self._files = {}
-        self._line_buffer = bytes()
+        self._line_buffer = bytearray()
 
     @property
     def files(self):
         return self._files
 
+    @staticmethod
+    def _level(path):
+        return len([ p for p in path.split('/') if p ])
+
     def _indent(self, level):
-        return ' '*4*(level + self._level_offset)
+        return ' '*4*level
 
     def data_consumer(self, b):
         # b could be any fragment or combination of lines!
-        # Drop \x04 returned after softreset (???)
-        self._line_buffer += b.replace(b'\x04', b'')
-        while b'\r\n' in self._line_buffer:
-            line, self._line_buffer = self._line_buffer.split(b'\r\n', 1)
-            kind, level, path, mtime, size = line.split(b',')
-            path = eval(path)
-            if len(path)<=0: continue
-            level = int(level)
-            size  = int(size)
+        buf = self._line_buffer
+        buf += b
+        start = 0
+        while True:
+            end = buf.find(b'\n', start)
+            if end < 0: break
+            self._parse(bytes(buf[start:end]).strip(b'\r\x04'))
+            start = end + 1
+        del buf[:start]
+
+    def _parse(self, line):
+        try:
+            kind, size, mtime, path = line.split(b' ', 3)
+            size = int(size)
             mtime = int(self.local2gmtime(int(mtime)))
-            mtime_fmt = datetime.fromtimestamp(mtime).strftime("%b %d %H:%M %Y")
-            full_path = os.path.join(*self._path_stack[:level], path)
-            if kind == b'D':
-                self._files[full_path] = (mtime, -1)
-                while len(self._path_stack) < level+1:
-                    self._path_stack.append('')
-                self._path_stack[level] = path
-                if level != 0:
-                    if self._show and self._output:
-                        path += '/'
-                        self._output(f"{' ':7}  {' ':18} {self._indent(level)}{colored(path, 'green')}\n")
-                else:
-                    self._level_offset = -1
-            else:
-                self._files[full_path] = (mtime, size)
-                if self._output:
-                    if self._show:
-                        self._output(f"{int(size):7}  {mtime_fmt:18} {self._indent(level)}{colored(path, 'blue')}\n")
-                    elif len(self._files) > 50 and len(self._files) % 10 == 0:
-                        # show progress
-                        self._output('.')
-
-
-###############################################################################
-# code snippet (runs on remote)
-
-_rlist_func = """
-t_off = 0
-try:
-    import machine
-    t_off = 946684800
-except ImportError:
-    pass
-
-import os
-def rlist(path, level=0):
-    stat = os.stat(path)
-    fsize = stat[6]
-    mtime = stat[7] + t_off
-    if stat[0] & 0x4000:
-        up = os.getcwd()
-        os.chdir(path)
-        print("D,{},{},{},-1".format(level, repr(path), mtime))
-        for p in sorted(os.listdir()):
-            if p.startswith('.'): continue
-            rlist(p, level+1)
-        os.chdir(up)
-    else:
-        print("F,{},{},{},{}".format(level, repr(path), mtime, fsize))
-"""
+            path = path.decode()
+        except ValueError:
+            logger.debug(f"rlist: malformed line {line}")
+            return
+        if kind == b'D':
+            self._files[path] = (mtime, -1)
+            self._dir = path
+            self._dir_level = level = self._level(path) - self._root_level
+            if level > 0 and self._show and self._output:
+                self._output(f"{' ':7}  {' ':18} {self._indent(level-1)}{colored(os.path.basename(path) + '/', 'green')}\n")
+        else:
+            full_path = os.path.join(self._dir, path) if self._dir else path
+            self._files[full_path] = (mtime, size)
+            if self._output:
+                if self._show:
+                    mtime_fmt = datetime.fromtimestamp(mtime).strftime("%b %d %H:%M %Y")
+                    self._output(f"{size:7}  {mtime_fmt:18} {self._indent(self._dir_level)}{colored(path, 'blue')}\n")
+                elif len(self._files) > 50 and len(self._files) % 10 == 0:
+                    # show progress
+                    self._output('.')
@@ -2,13 +2,15 @@ from .eval import RemoteError
 from .eval_rlist import EvalRlist
 from .utilities import cd
 from .env import Env
+from .manifest import Manifest
+from .file_watcher import FileWatcher
 
 from termcolor import colored
 from glob import glob
 from fnmatch import fnmatch
 from collections import OrderedDict
 
-import time, os, logging
+import time, os, hashlib, logging
 
 logger = logging.getLogger(os.path.splitext(os.path.basename(__file__))[0])
 
@@ -27,20 +29,47 @@ class EvalRsync(EvalRlist):
 
     def rsync(self, data_consumer, *,
             dry_run=True,
-            upload_only=True):
+            upload_only=True,
+            compare='time',
+            full=False,
+            bundle=False,
+            bundle_size=0,
+            host_files=None):
         # synchronize micrcontroller flash to host
         #   dry_run: only print out differences, do not copy any files
         #   upload_only: do not delete files on microcontroller that are not also on host
+        #   compare: 'time' updates files that differ in size or are newer on the host,
+        #            'hash' updates files that differ in size or content (hashed on mcu)
+        #   full: list all files on mcu rather than updating the manifest from the last sync
+        #   bundle: upload all files in bundles, each with a single receiver on the mcu
+        #   bundle_size: maximum bytes per bundle, 0 for free memory on mcu
+        #   host_files: DeviceConfig.resource_files, computed if None
+        # returns dict with counts of deleted, added and updated files,
+        # and uncompressed (size) and transferred (sent) bytes
         if not dry_run:
             # sync mcu time to host if they differ by more than 3 seconds
             self.sync_time(3)
         # mcu files & excludes
-        mcu_files = self.rlist('/', data_consumer)
+        manifest = Manifest(self.device.uid)
+        # advertised by device (broadcasts), changes when files on mcu change
+        generation = self.device.advertisement.get('generation')
+        # file mtimes are not needed to compare hashes, saves a stat per file on the mcu
+        file_mtimes = compare != 'hash'
+        if full or not manifest.files:
+            mcu_files = self.rlist('/', data_consumer, mtime=file_mtimes)
+        elif generation is not None and generation == manifest.generation:
+            # no changes on mcu since last sync
+            mcu_files = dict(manifest.files)
+        else:
+            mcu_files = self._refresh(manifest.files, data_consumer, file_mtimes)
         mcu_files.pop("/boot_out.txt", None)
         # host files
-        host_files = self.device.config.resource_files
-        del_, add_, upd_ = self._diff(mcu_files, host_files)
+        if host_files is None:
+            host_files = self.device.config.resource_files
+        del_, add_, upd_ = self._diff(mcu_files, host_files, compare)
         same = True
+        # uncompressed and transferred bytes
+        size = sent = 0
         for dst_file in del_:
             # delete first (protect against a bug that deletes what was just copied)
             if not upload_only:
@@ -48,22 +77,130 @@ class EvalRsync(EvalRlist):
                 data_consumer(colored(f"DELETE  {dst_file}\n", 'red'))
                 if not dry_run:
                     self.rm_rf(dst_file)
+        bundle_files = []
         for dst_file, src_file in add_.items():
             # no feedback about directory creation
             if os.path.isfile(src_file):
                 same = False
                 data_consumer(colored(f"ADD     {dst_file}\n", 'green'))
-            if not dry_run:
-                self.fput(src_file, dst_file)
+                if bundle:
+                    bundle_files.append((src_file, dst_file))
+                    continue
+            if not dry_run and not bundle:
+                n = self.fput(src_file, dst_file)
+                if n:
+                    size += host_files[dst_file][1]
+                    sent += n
         for dst_file, src_file in upd_.items():
             same = False
             data_consumer(colored(f"UPDATE  {dst_file}\n", 'blue'))
-            if not dry_run:
-                self.fput(src_file, dst_file)
+            if bundle:
+                bundle_files.append((src_file, dst_file))
+            elif not dry_run:
+                sent += self.fput(src_file, dst_file) or 0
+                size += host_files[dst_file][1]
+        if bundle_files and not dry_run:
+            size += sum(host_files[dst_file][1] for _, dst_file in bundle_files)
+            sent += self._put_bundles(bundle_files, host_files, bundle_size, data_consumer)
         if same:
             data_consumer(colored("Directories match\n", 'green'))
+        elif sent < size:
+            data_consumer(colored(f"Compression saved {size-sent} of {size} bytes ({100*(size-sent)//size}%)\n", 'green'))
+        if not dry_run:
+            if not upload_only:
+                for dst_file in del_:
+                    _remove_tree(mcu_files, dst_file)
+            # record new mtimes, including parent folders
+            changed = set(add_) | set(upd_)
+            changed |= { os.path.dirname(p) for p in changed }
+            mcu_files.update(self.rstat(sorted(changed)))
+        # generation after uploading files is not known
+        manifest.save(mcu_files, generation if dry_run or same else None)
+        return {
+            'deleted': 0 if upload_only else len(del_),
+            'added': sum(1 for f in add_.values() if os.path.isfile(f)),
+            'updated': len(upd_),
+            'size': size,
+            'sent': sent,
+        }
+
+    def watch(self, data_consumer, **kwargs):
+        """Push changes of resource files to the mcu as they are saved.
+        See watch (module level) for arguments."""
+        return watch([self], data_consumer, **kwargs)
+
+    def _push(self, updated, deleted, data_consumer):
+        # upload updated (dict mcu_file -> host_file), delete deleted, update manifest
+        name = self.device.name
+        for dst_file in deleted:
+            data_consumer(colored(f"{name}: DELETE  {dst_file}\n", 'red'))
+            self.rm_rf(dst_file)
+        files = [ (src_file, dst_file) for dst_file, src_file in updated.items() ]
+        for _, dst_file in files:
+            data_consumer(colored(f"{name}: PUSH    {dst_file}\n", 'blue'))
+        if len(files) == 1:
+            self.fput(*files[0])
+        elif files:
+            _, errors = self.fput_bundle(files)
+            for dst_file, msg in errors.items():
+                data_consumer(colored(f"{name}: FAILED  {dst_file} ({msg})\n", 'red'))
+        manifest = Manifest(self.device.uid)
+        if manifest.files:
+            mcu_files = dict(manifest.files)
+            for dst_file in deleted:
+                _remove_tree(mcu_files, dst_file)
+            changed = set(updated)
+            changed |= { os.path.dirname(p) for p in changed }
+            mcu_files.update(self.rstat(sorted(changed)))
+            manifest.save(mcu_files)
+
+    def _put_bundles(self, files, host_files, bundle_size, data_consumer):
+        # upload files in bundles of at most bundle_size bytes, report errors
+        if bundle_size <= 0:
+            bundle_size = max(16*1024, self.mem_free())
+        sent = 0
+        bundle = []
+        bundle_bytes = 0
+        for i, (src_file, dst_file) in enumerate(files):
+            bundle.append((src_file, dst_file))
+            bundle_bytes += host_files[dst_file][1]
+            if i < len(files)-1 and bundle_bytes + host_files[files[i+1][1]][1] <= bundle_size:
+                continue
+            n, errors = self.fput_bundle(bundle, data_consumer=data_consumer)
+            sent += n
+            for dst, msg in errors.items():
+                data_consumer(colored(f"FAILED  {dst} ({msg})\n", 'red'))
+            bundle = []
+            bundle_bytes = 0
+        return sent
+
+    def _refresh(self, files, data_consumer=None, file_mtimes=True):
+        # update listing from previous sync: stat all entries and
+        # list only folders whose mtime changed (file_mtimes: see rlist mtime)
+        paths = sorted(files)
+        stats = self.rstat(paths)
+        result = {}
+        changed = []
+        for path in paths:
+            if not path in stats: continue
+            mtime, size = stats[path]
+            old = files[path]
+            if size < 0 and mtime != old[0]:
+                changed.append(path)
+            # keep hash if file did not change
+            h = old[2] if len(old) > 2 and (mtime, size) == tuple(old[:2]) else None
+            result[path] = (mtime, size, h)
+        listed = []
+        for path in changed:
+            # sorted: parents before children
+            if any(_in_tree(path, p) for p in listed): continue
+            _remove_tree(result, path)
+            result.update(self.rlist(path, data_consumer, mtime=file_mtimes))
+            listed.append(path)
+        logger.debug(f"refresh: {len(paths)} entries, listed {listed}")
+        return result
 
-    def _diff(self, mcu_files, host_files):
+    def _diff(self, mcu_files, host_files, compare='time'):
         # determine difference between host (projects) and mcu
         # delete files not on host
         to_delete = mcu_files.keys() - host_files.keys()
@@ -71,16 +208,159 @@ class EvalRsync(EvalRlist):
         to_add = host_files.keys() - mcu_files.keys()
         # in both: may need updating
         to_update = set()
+        to_hash = set()
         for u in mcu_files.keys() & host_files.keys():
-            mcu_time, mcu_size = mcu_files[u]
-            host_time, host_size, _ = host_files[u]
+            mcu_time, mcu_size = mcu_files[u][:2]
+            host_time, host_size = host_files[u][:2]
             # mcu_size < 0 indicates directory
             if mcu_size < 0: continue
-            if mcu_size != host_size or mcu_time < host_time:
+            if mcu_size != host_size:
                 to_update.add(u)
+            elif compare == 'hash':
+                to_hash.add(u)
+            elif mcu_time < host_time:
+                to_update.add(u)
+        if to_hash:
+            to_update |= self._hash_diff(sorted(to_hash), mcu_files, host_files)
         # convert to_add and to_update to ordered dicts full_path --> host_path
         return (
             sorted(to_delete, reverse=True),
             OrderedDict(sorted({ k: host_files[k][-1] for k in to_add }.items())),
             OrderedDict(sorted({ k: host_files[k][-1] for k in to_update }.items()))
         )
+
+    def _hash_diff(self, files, mcu_files, host_files):
+        # files whose content on mcu differs from host
+        # hashes of unchanged files are known from the manifest, as 'algo:digest'
+        known = { u: mcu_files[u][2] for u in files if len(mcu_files[u]) > 2 and mcu_files[u][2] }
+        unknown = [ u for u in files if not u in known ]
+        if unknown:
+            try:
+                res = self._remote_exec(f"hashes({repr(unknown)})", timeout=10)
+            except RemoteError as e:
+                # no hashlib on mcu, compare times
+                logger.info(f"rsync: cannot hash files on {self.device}, comparing times ({e})")
+                # listed without mtimes
+                mcu_files.update(self.rstat([ u for u in files if not mcu_files[u][0] ]))
+                return { u for u in files if mcu_files[u][0] < host_files[u][0] }
+            algo, *digests = res.decode().split()
+            for u, digest in zip(unknown, digests):
+                known[u] = f"{algo}:{digest}"
+                if digest != '-':
+                    mcu_files[u] = tuple(mcu_files[u][:2]) + (known[u], )
+        result = set()
+        for u, h in known.items():
+            algo, digest = h.split(':', 1)
+            host_time, host_size, host_path = host_files[u][:3]
+            if digest != host_hash(host_path, host_time, host_size, algo):
+                result.add(u)
+        return result
+
+
+def watch(repls, data_consumer, *, upload_only=True, debounce=0.3, poll_interval=1, stop=None):
+    """Keep mcus in sync with the host while resource files are edited.
+
+    repls: EvalRsync of open connections (e.g. `with dev as repl`)
+    upload_only: do not delete files on the mcu that are deleted on the host
+    debounce: seconds without further changes before pushing
+    poll_interval: seconds between scans if inotify is not available
+    stop: threading.Event, watch until set or KeyboardInterrupt
+
+    Runs rsync first, then watches the resource folders on the host and
+    pushes only changed files, without listing files on the mcu.
+    Changes to the device configuration (yaml) are not picked up.
+    Returns the number of pushes.
+    """
+    # mcus with the same resources share host files
+    groups = {}
+    for repl in repls:
+        config = repl.device.config
+        group = groups.get(config.resource_key)
+        if not group:
+            group = groups[config.resource_key] = _WatchGroup(config)
+        group.repls.append(repl)
+    for group in groups.values():
+        for repl in group.repls:
+            data_consumer(f"rsync {repl.device.name}\n")
+            repl.rsync(data_consumer, dry_run=False, upload_only=upload_only, host_files=group.files)
+    paths = { r.host_path for group in groups.values() for r in group.resources }
+    data_consumer(colored(f"Watching {len(paths)} resources, ^C to stop\n", 'green'))
+    pushes = 0
+    with FileWatcher(paths, debounce, poll_interval) as watcher:
+        try:
+            while not (stop and stop.is_set()):
+                changed = watcher.wait(0.5)
+                if not changed: continue
+                for group in groups.values():
+                    updated, deleted = group.update(changed)
+                    if upload_only: deleted = []
+                    if not (updated or deleted): continue
+                    for repl in group.repls:
+                        try:
+                            repl._push(updated, deleted, data_consumer)
+                            pushes += 1
+                        except RemoteError as e:
+                            data_consumer(colored(f"{repl.device.name}: FAILED {e}\n", 'red'))
+        except KeyboardInterrupt:
+            pass
+    return pushes
+
+
+class _WatchGroup:
+    """Host files of a configuration, rescanned per resource"""
+
+    def __init__(self, config):
+        self.repls = []
+        self.resources = config.resources
+        self._files = [ r.mcu_files() for r in self.resources ]
+        self.files = self._merge()
+
+    def _merge(self):
+        files = {}
+        for f in self._files:
+            files.update(f)
+        return files
+
+    def update(self, changed):
+        """Rescan resources containing changed host paths.
+        Returns (dict mcu_file -> host_file of new or modified files, deleted mcu paths)"""
+        for i, r in enumerate(self.resources):
+            root = r.host_path
+            if any(_in_tree(p, root) or _in_tree(root, p) for p in changed):
+                self._files[i] = r.mcu_files()
+        old, self.files = self.files, self._merge()
+        updated = OrderedDict(sorted(
+            (k, v[2]) for k, v in self.files.items() if v[1] >= 0 and tuple(old.get(k, ())[:2]) != v[:2] ))
+        deleted = []
+        for p in sorted(old.keys() - self.files.keys()):
+            # children are deleted with their folder
+            if not (deleted and _in_tree(p, deleted[-1])):
+                deleted.append(p)
+        return updated, deleted
+
+
+def _in_tree(path, root):
+    return path == root or path.startswith(root.rstrip('/') + '/')
+
+def _remove_tree(files, root):
+    for path in [ p for p in files if _in_tree(p, root) ]:
+        del files[path]
+
+
+###############################################################################
+# Host file hashes
+
+# (path, mtime, size, algorithm) -> hexdigest
+_host_hashes = {}
+
+def host_hash(path, mtime, size, algo='sha256'):
+    """Hexdigest of host file, cached by path, mtime and size"""
+    key = (path, mtime, size, algo)
+    digest = _host_hashes.get(key)
+    if digest is None:
+        h = hashlib.new(algo)
+        with open(path, 'rb') as f:
+            for b in iter(lambda: f.read(65536), b''):
+                h.update(b)
+        digest = _host_hashes[key] = h.hexdigest()
+    return digest
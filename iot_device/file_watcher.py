@@ -0,0 +1,197 @@
+import ctypes, ctypes.util, select, struct, sys, time, os, logging
+
+logger = logging.getLogger(os.path.splitext(os.path.basename(__file__))[0])
+
+
+class FileWatcher:
+    """Report changes to files in folders (recursively) or to single files.
+
+    Uses inotify on Linux, otherwise polls (mtime and size) every
+    poll_interval seconds. Hidden files and folders are ignored.
+
+    Usage:
+        with FileWatcher(paths) as watcher:
+            while True:
+                changed = watcher.wait(1)
+    """
+
+    def __init__(self, paths, debounce:float=0.3, poll_interval:float=1):
+        self.debounce = debounce
+        paths = [ os.path.abspath(p) for p in paths ]
+        try:
+            self._backend = _Inotify(paths)
+        except OSError as e:
+            logger.info(f"inotify not available ({e}), polling")
+            self._backend = _Poller(paths, poll_interval)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def close(self):
+        self._backend.close()
+
+    def wait(self, timeout=None) -> set:
+        """Paths changed (created, modified, or deleted), empty if none within timeout.
+        Returns once there have been no changes for debounce seconds,
+        so that a burst of edits (e.g. save all) is reported at once."""
+        changes = self._backend.poll(timeout)
+        if changes:
+            while True:
+                more = self._backend.poll(self.debounce)
+                if not more: break
+                changes |= more
+        return changes
+
+
+###############################################################################
+# Backends: poll(timeout) -> set of paths
+
+def _hidden(name):
+    return name.startswith('.')
+
+
+class _Inotify:
+
+    IN_MODIFY      = 0x00000002
+    IN_ATTRIB      = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM  = 0x00000040
+    IN_MOVED_TO    = 0x00000080
+    IN_CREATE      = 0x00000100
+    IN_DELETE      = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_Q_OVERFLOW  = 0x00004000
+    IN_IGNORED     = 0x00008000
+    IN_ISDIR       = 0x40000000
+
+    MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | \
+           IN_CREATE | IN_DELETE | IN_DELETE_SELF
+
+    # struct inotify_event { int wd; uint32_t mask, cookie, len; char name[]; }
+    EVENT = struct.Struct('iIII')
+
+    def __init__(self, paths):
+        if not sys.platform.startswith('linux'):
+            raise OSError(f"not supported on {sys.platform}")
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        if not hasattr(libc, 'inotify_init1'):
+            raise OSError("libc without inotify")
+        self._libc = libc
+        self._fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1")
+        self._paths = paths
+        # watch descriptor -> folder
+        self._wd = {}
+        for path in paths:
+            if os.path.isdir(path):
+                self._add_tree(path)
+            else:
+                # editors replace files, watch the folder
+                self._add(os.path.dirname(path))
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+    def _add(self, folder):
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(folder), self.MASK)
+        if wd < 0:
+            logger.debug(f"cannot watch {folder}: {os.strerror(ctypes.get_errno())}")
+        else:
+            self._wd[wd] = folder
+
+    def _add_tree(self, folder):
+        for root, dirs, _ in os.walk(folder):
+            dirs[:] = [ d for d in dirs if not _hidden(d) ]
+            self._add(root)
+
+    def poll(self, timeout):
+        r, _, _ = select.select([self._fd], [], [], timeout)
+        if not r: return set()
+        try:
+            buf = os.read(self._fd, 64*1024)
+        except BlockingIOError:
+            return set()
+        changes = set()
+        i = 0
+        while i < len(buf):
+            wd, mask, _, n = self.EVENT.unpack_from(buf, i)
+            i += self.EVENT.size
+            name = buf[i:i+n].rstrip(b'\0').decode(errors='surrogateescape')
+            i += n
+            if mask & self.IN_Q_OVERFLOW:
+                # events lost
+                changes.update(self._paths)
+                continue
+            if mask & self.IN_IGNORED:
+                self._wd.pop(wd, None)
+                continue
+            folder = self._wd.get(wd)
+            if folder is None: continue
+            if not name:
+                # folder itself, e.g. deleted
+                changes.add(folder)
+                continue
+            if _hidden(name): continue
+            path = os.path.join(folder, name)
+            if mask & self.IN_ISDIR and mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                self._add_tree(path)
+            changes.add(path)
+        return changes
+
+
+class _Poller:
+
+    def __init__(self, paths, interval):
+        self._paths = paths
+        self._interval = interval
+        self._state = self._scan()
+
+    def close(self):
+        pass
+
+    def _scan(self):
+        # path -> (mtime, size)
+        state = {}
+        for path in self._paths:
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if not os.path.isdir(path):
+                state[path] = (st.st_mtime_ns, st.st_size)
+            # folders are compared by contents, their mtime changes with hidden files too
+            stack = [ path ] if os.path.isdir(path) else []
+            while stack:
+                try:
+                    it = os.scandir(stack.pop())
+                except OSError:
+                    continue
+                with it:
+                    for entry in it:
+                        if _hidden(entry.name): continue
+                        try:
+                            if entry.is_dir():
+                                stack.append(entry.path)
+                            else:
+                                st = entry.stat()
+                                state[entry.path] = (st.st_mtime_ns, st.st_size)
+                        except OSError:
+                            pass
+        return state
+
+    def poll(self, timeout):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = self._interval if deadline is None else min(self._interval, deadline - time.monotonic())
+            if wait > 0:
+                time.sleep(wait)
+            old, self._state = self._state, self._scan()
+            changes = { p for p in old.keys() | self._state.keys() if old.get(p) != self._state.get(p) }
+            if changes or (deadline is not None and time.monotonic() >= deadline):
+                return changes
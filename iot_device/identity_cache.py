@@ -0,0 +1,57 @@
+from .env import Env
+
+import json, os, threading, logging
+
+logger = logging.getLogger(os.path.splitext(os.path.basename(__file__))[0])
+
+
+class IdentityCache:
+    """Host side record of device identities, (uid, implementation, platform).
+
+    Keyed by url and a hint from discovery that changes if a different
+    device shows up at the url, e.g. the USB serial number for serial ports
+    or the advertised uid. Lets DeviceRegistry create devices without
+    connecting to them.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = None
+
+    @property
+    def file(self) -> str:
+        """Location of cache on host"""
+        return os.path.join(Env.expand_path(Env.iot_cache()), 'identities.json')
+
+    def get(self, url:str, hint:str):
+        """(uid, implementation, platform) or None if not known"""
+        with self._lock:
+            identity = self._load().get(f"{url} {hint}")
+        return tuple(identity) if identity else None
+
+    def put(self, url:str, hint:str, identity:tuple):
+        with self._lock:
+            entries = self._load()
+            key = f"{url} {hint}"
+            if entries.get(key) == list(identity): return
+            entries[key] = list(identity)
+            try:
+                os.makedirs(os.path.dirname(self.file), exist_ok=True)
+                tmp = self.file + '~'
+                with open(tmp, 'w') as f:
+                    json.dump(entries, f)
+                os.replace(tmp, self.file)
+            except OSError as e:
+                logger.info(f"cannot save {self.file}: {e}")
+
+    def _load(self):
+        if self._entries is None:
+            try:
+                with open(self.file) as f:
+                    self._entries = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.debug(f"no identity cache: {e}")
+                self._entries = {}
+        return self._entries
+
+identity_cache = IdentityCache()
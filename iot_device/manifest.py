@@ -0,0 +1,53 @@
+from .env import Env
+
+import json, os, logging
+
+logger = logging.getLogger(os.path.splitext(os.path.basename(__file__))[0])
+
+
+class Manifest:
+    """Host side record of the files on a device, saved after each rsync.
+
+    files: dict path -> (mtime, size, hash)
+        size is -1 for directories, hash is None if not known.
+    generation: file system generation advertised by the device when
+        files was last known to be up to date, None if not known.
+    """
+
+    def __init__(self, uid:str):
+        self._uid = uid
+        self.load()
+
+    @property
+    def file(self) -> str:
+        """Location of manifest on host"""
+        name = self._uid.replace(':', '') + '.json'
+        return os.path.join(Env.expand_path(Env.iot_cache()), 'manifests', name)
+
+    def load(self):
+        try:
+            with open(self.file) as f:
+                data = json.load(f)
+            self.generation = data.get('generation')
+            self.files = { k: tuple(v) for k, v in data['files'].items() }
+        except (OSError, ValueError, KeyError, AttributeError) as e:
+            logger.debug(f"no manifest for {self._uid}: {e}")
+            self.files = {}
+            self.generation = None
+
+    def save(self, files:dict, generation:int=None):
+        self.files = files
+        self.generation = generation
+        os.makedirs(os.path.dirname(self.file), exist_ok=True)
+        tmp = self.file + '~'
+        with open(tmp, 'w') as f:
+            json.dump({ 'generation': generation, 'files': files }, f)
+        os.replace(tmp, self.file)
+
+    def clear(self):
+        self.files = {}
+        self.generation = None
+        try:
+            os.remove(self.file)
+        except FileNotFoundError:
+            pass
@@ -14,8 +14,8 @@ class PasswordError(Exception):
 
 class MpDevice(Device):
 
-    def __init__(self, url):
-        super().__init__(url)
+    def __init__(self, url, hint=None):
+        super().__init__(url, hint)
 
     def __enter__(self):
         assert self.scheme == "mp"
@@ -28,7 +28,7 @@ class MpDevice(Device):
         logger.debug(f"version {version}")
         if version == '': raise RemoteError(f"Device is offline")
         if version != VERSION: raise RemoteError(f"Wrong mp version: client={repr(VERSION)}, server={repr(version)}")
-        s.sendall(Secrets.get_attr("mp_pwd", "?").encode())
+        s.sendall(Secrets.get('mp_pwd', '?', str).encode())
         s.sendall(b'\n')
         ok = self.readline()
         logger.debug(f"ok = {ok}")
@@ -1,15 +1,22 @@
 from .eval import RemoteError
 from .eval_rsync import EvalRsync
-import socket, os, struct, time
+from .eval_file_ops import ZLIB_WBITS
+import socket, os, struct, time, io, zlib
 
 
 EOT = b'\x04'
 
+# compress files larger than this (bytes) for transfer
+MIN_COMPRESS_SIZE = 1024
+# suffix of compressed temporary file on mcu
+ZTMP = '.z~'
+
 class MpProtocol(EvalRsync):
 
     def __init__(self, device):
         assert device.scheme == "mp"
         super().__init__(device)
+        device.verify(self)
 
     # implement abstract exec
     def exec(self, code: str, *, data_consumer=None, timeout=10) -> bytes:
@@ -29,7 +36,42 @@ class MpProtocol(EvalRsync):
             raise RemoteError("", res, err)
         return res
 
-    def fget(self, src, dst, chunk_size=-1):
+    def fget(self, src, dst, chunk_size=-1, data_consumer=None):
+        """Copy from microcontroller to host, compressed if supported by the mcu.
+        Returns the number of (compressed) bytes transferred."""
+        if self.compression()[1]:
+            tmp = src + ZTMP
+            self._remote_exec(f"zip_file({repr(src)}, {repr(tmp)}, {ZLIB_WBITS})")
+            try:
+                buf = io.BytesIO()
+                self._fget(tmp, buf)
+            finally:
+                self.rm_rf(tmp)
+            with open(dst, 'wb') as f:
+                f.write(zlib.decompress(buf.getvalue(), -ZLIB_WBITS))
+            return buf.tell()
+        with open(dst, 'wb') as f:
+            return self._fget(src, f)
+
+    # override ExecFileOps
+    def fput(self, src, dst, chunk_size=-1, data_consumer=None):
+        """Copy from host to microcontroller, compressed if supported by the mcu.
+        Returns the number of (compressed) bytes transferred."""
+        if not os.path.isfile(src): return 0
+        with open(src, 'rb') as f:
+            data = f.read()
+        if len(data) > MIN_COMPRESS_SIZE and self.compression()[0]:
+            c = zlib.compressobj(9, zlib.DEFLATED, -ZLIB_WBITS)
+            z = c.compress(data) + c.flush()
+            if len(z) < len(data):
+                tmp = dst + ZTMP
+                self._fput(z, tmp)
+                self._remote_exec(f"unzip_file({repr(tmp)}, {repr(dst)}, {ZLIB_WBITS})")
+                return len(z)
+        self._fput(data, dst)
+        return len(data)
+
+    def _fget(self, src, f):
         self.sendall(b'fget\n')
         self.sendall(src.encode())
         self.sendall(b'\n')
@@ -37,23 +79,19 @@ class MpProtocol(EvalRsync):
         if ok != 'OK': raise RemoteError(f"fget: expected OK, got {ok}")
         sz = int(self.readline())
         n = 0
-        with open(dst, 'wb') as f:
-            n = 0
-            while n < sz:
-                b = self.recv(min(1024, sz-n))
-                f.write(b)
-                n += len(b)
+        while n < sz:
+            b = self.recv(min(1024, sz-n))
+            f.write(b)
+            n += len(b)
+        return n
 
-    # override ExecFileOps
-    def fput(self, src, dst):
-        sz = os.path.getsize(src)
+    def _fput(self, data, dst):
         self.sendall(b"fput\n")
         self.sendall(dst.encode())
         self.sendall(b'\n')
-        self.sendall(str(sz).encode())
+        self.sendall(str(len(data)).encode())
         self.sendall(b'\n')
-        with open(src, 'rb') as f:
-            self.sendall(f.read())
+        self.sendall(data)
         ok = self.readline(timeout=10)
         if ok != 'OK': raise RemoteError(f"fput: expected OK, got {ok}")
 
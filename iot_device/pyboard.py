@@ -72,6 +72,12 @@ import time
 import os
 import ast
 
+try:
+    from .read_buffer import ReadBuffer
+except ImportError:
+    # run as script
+    from read_buffer import ReadBuffer
+
 try:
     stdout = sys.stdout.buffer
 except AttributeError:
@@ -292,35 +298,14 @@ class Pyboard:
                 raise PyboardError("failed to access " + device)
             if delayed:
                 print("")
+        self.serial = ReadBuffer(self.serial)
 
     def close(self):
         self.serial.close()
 
     def read_until(self, min_num_bytes, ending, timeout=10, data_consumer=None):
         # if data_consumer is used then data is not accumulated and the ending must be 1 byte long
-        assert data_consumer is None or len(ending) == 1
-
-        data = self.serial.read(min_num_bytes)
-        if data_consumer:
-            data_consumer(data)
-        timeout_count = 0
-        while True:
-            if data.endswith(ending):
-                break
-            elif self.serial.inWaiting() > 0:
-                new_data = self.serial.read(1)
-                if data_consumer:
-                    data_consumer(new_data)
-                    data = new_data
-                else:
-                    data = data + new_data
-                timeout_count = 0
-            else:
-                timeout_count += 1
-                if timeout is not None and timeout_count >= 100 * timeout:
-                    break
-                time.sleep(0.01)
-        return data
+        return self.serial.read_until(min_num_bytes, ending, timeout, data_consumer)
 
     def enter_raw_repl(self, soft_reset=True):
         self.serial.write(b"\r\x03\x03")  # ctrl-C twice: interrupt any running program
@@ -1,4 +1,5 @@
 from .pyboard import Pyboard, PyboardError
+from .read_buffer import ReadBuffer
 
 import logging, time, os
 
@@ -24,33 +25,7 @@ class Pydevice(Pyboard):
             device.use_raw_paste = True
         self.use_raw_paste = device.use_raw_paste
         # initialize Pyboard
-        self.serial = device
-
-    def read_until(self, min_num_bytes, ending, timeout=10, data_consumer=None):
-        # patch: don't call data_consumer on single chars (if more data is available)
-        #        kernel print is very slow on Pi
-        # if data_consumer is used then data is not accumulated and the ending must be 1 byte long
-        assert data_consumer is None or len(ending) == 1
-        data = self.serial.read(min_num_bytes)
-        timeout_count = 0
-        while True:
-            if data.endswith(ending):
-                if data_consumer:
-                    data_consumer(data)
-                break
-            if self.serial.inWaiting() > 0:
-                new_data = self.serial.read(1)
-                data = data + new_data
-                timeout_count = 0
-            else:
-                if data_consumer and len(data) > 0:
-                    data_consumer(data)
-                    data = b''
-                timeout_count += 1
-                if timeout is not None and timeout_count >= 100 * timeout:
-                    break
-                time.sleep(0.01)
-        return data
+        self.serial = ReadBuffer(device)
 
     def exec(self, command, *, data_consumer=None, timeout=None):
         ret, ret_err = self.exec_raw(command, timeout=timeout, data_consumer=data_consumer)
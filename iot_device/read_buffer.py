@@ -0,0 +1,97 @@
+import select, time
+
+
+class ReadBuffer:
+    """Buffered reads from a serial-like stream (read, write, inWaiting).
+
+    Pulls everything the stream has available in one call and keeps
+    bytes received past a match for subsequent reads. These are lost to
+    anyone reading from the stream directly, callers that hand the
+    stream over take them with drain() first. Waits for data
+    with stream.wait_readable(timeout) or select on stream.fileno(),
+    falling back to polling if neither is available.
+    All other attributes are forwarded to the stream.
+    """
+
+    # upper bound for a single wait, in seconds
+    MAX_WAIT = 0.5
+
+    def __init__(self, stream):
+        self._stream = stream
+        self._buf = bytearray()
+        self._wait = getattr(stream, 'wait_readable', None)
+        if self._wait is None and hasattr(stream, 'fileno'):
+            self._wait = self._select
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+    def read(self, size=1):
+        """Read size bytes (fewer on timeout of the underlying stream)."""
+        if len(self._buf) < size:
+            self._buf += self._stream.read(size - len(self._buf))
+        data = bytes(self._buf[:size])
+        del self._buf[:size]
+        return data
+
+    def drain(self) -> bytes:
+        """Bytes received from the stream but not read yet, removed from the buffer."""
+        data = bytes(self._buf)
+        self._buf.clear()
+        return data
+
+    def inWaiting(self):
+        if self._buf:
+            return len(self._buf)
+        return self._stream.inWaiting()
+
+    def read_until(self, min_num_bytes, ending, timeout=10, data_consumer=None):
+        """Read until ending is received.
+
+        timeout: seconds without receiving data before giving up, None for no limit.
+        If data_consumer is given, data is passed to it as it arrives
+        (including the ending) and only the last chunk is returned.
+        In that case, ending must be one byte long.
+        """
+        assert data_consumer is None or len(ending) == 1
+        buf = self._buf
+        if len(buf) < min_num_bytes:
+            buf += self._stream.read(min_num_bytes - len(buf))
+        start = max(0, min_num_bytes - len(ending))
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            i = buf.find(ending, start)
+            if i >= 0:
+                n = i + len(ending)
+                data = bytes(buf[:n])
+                del buf[:n]
+                if data_consumer:
+                    data_consumer(data)
+                return data
+            if data_consumer and buf:
+                data_consumer(bytes(buf))
+                buf.clear()
+            start = max(0, len(buf) - len(ending) + 1)
+            n = self._stream.inWaiting()
+            if n > 0:
+                buf += self._stream.read(n)
+                if timeout is not None:
+                    deadline = time.monotonic() + timeout
+                continue
+            if deadline is None:
+                wait = self.MAX_WAIT
+            else:
+                wait = min(self.MAX_WAIT, deadline - time.monotonic())
+                if wait <= 0:
+                    break
+            if self._wait:
+                self._wait(wait)
+            else:
+                time.sleep(min(wait, 0.01))
+        data = bytes(buf)
+        buf.clear()
+        return data
+
+    def _select(self, timeout):
+        r, _, _ = select.select([self._stream], [], [], timeout)
+        return bool(r)
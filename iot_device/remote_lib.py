@@ -0,0 +1,320 @@
+"""Helper library for the mcu.
+
+Uploaded once per session and executed in namespace __iot49__ on the mcu,
+EvalFileOps._remote_exec runs code in this namespace.
+__iot49__['__ver__'] identifies the version, the library is uploaded
+again only if it is missing (e.g. after a reset) or outdated.
+"""
+
+from hashlib import sha1
+
+
+###############################################################################
+# code snippets (run on remote)
+
+_imports = """
+import os, sys, time, gc
+"""
+
+_files_funcs = """
+def makedirs(path):
+    try:
+        os.mkdir(path)
+    except OSError as e:
+        if e.args[0]==2:
+            makedirs(path[:path.rfind('/')])
+            os.mkdir(path)
+        elif e.args[0]==17:
+            pass
+        else:
+            raise
+
+def rm_rf(path, r, f):
+    try:
+        mode = os.stat(path)[0]
+    except OSError:
+        return
+    if mode & 0x4000 != 0:
+        if r:
+            for file in os.listdir(path):
+                rm_rf(path + '/' + file, r, f)
+        if f:
+            try:
+                os.rmdir(path)
+            except OSError:
+                pass
+    else:
+        os.remove(path)
+
+def cat(path):
+    with open(path) as f:
+        while True:
+            line = f.readline()
+            if not line:
+                break
+            print(line, end="")
+"""
+
+_time_funcs = """
+def get_time():
+    print(tuple(time.localtime()), end="")
+
+def set_time(st, tolerance=5):
+    host  = time.mktime(st)
+    local = time.time()
+    # delete this comment, stops working with ws
+    if abs(host-local) < tolerance:
+        return
+    try:
+        import rtc
+        rtc.RTC().datetime = st
+    except ImportError:
+        import machine as m
+        st = list(st)
+        st.insert(3, st[6])
+        st[7] = 0
+        m.RTC().datetime(st[:8])
+"""
+
+_listing_funcs = """
+t_off = 0
+try:
+    import machine
+    t_off = 946684800
+except ImportError:
+    pass
+
+try:
+    ilistdir = os.ilistdir
+except AttributeError:
+    def ilistdir(path):
+        for name in os.listdir(path):
+            stat = os.stat(path + '/' + name)
+            yield name, stat[0] & 0xf000, 0, stat[6]
+
+def rlist(path, mtime=True):
+    stat = os.stat(path)
+    if not stat[0] & 0x4000:
+        print('F', stat[6], stat[7] + t_off, path)
+        return
+    stack = [path]
+    while stack:
+        path = stack.pop()
+        # folder mtimes are always listed (few stats), rsync refreshes by them
+        print('D', -1, os.stat(path)[7] + t_off, path)
+        path = path.rstrip('/')
+        for entry in ilistdir(path or '/'):
+            name = entry[0]
+            if name.startswith('.'): continue
+            p = path + '/' + name
+            if entry[1] & 0x4000:
+                stack.append(p)
+            elif mtime or len(entry) < 4:
+                stat = os.stat(p)
+                print('F', stat[6], stat[7] + t_off if mtime else 0, name)
+            else:
+                print('F', entry[3], 0, name)
+
+def rstat(paths):
+    for p in paths:
+        try:
+            stat = os.stat(p)
+            print(stat[7] + t_off, -1 if stat[0] & 0x4000 else stat[6], sep=',')
+        except OSError:
+            print('-')
+
+def hashes(paths):
+    try:
+        import hashlib
+    except ImportError:
+        import uhashlib as hashlib
+    try:
+        from binascii import hexlify
+    except ImportError:
+        try:
+            from ubinascii import hexlify
+        except ImportError:
+            hexlify = lambda b: ''.join('%02x' % x for x in b).encode()
+    algo = 'sha256' if hasattr(hashlib, 'sha256') else 'sha1'
+    h = getattr(hashlib, algo)
+    buf = bytearray(512)
+    mv = memoryview(buf)
+    print(algo)
+    for p in paths:
+        d = h()
+        try:
+            with open(p, 'rb') as f:
+                while True:
+                    n = f.readinto(buf)
+                    if not n: break
+                    d.update(mv[:n])
+            print(hexlify(d.digest()).decode())
+        except OSError:
+            print('-')
+"""
+
+_compression_funcs = """
+try:
+    import deflate, io
+    def decompress(b, wbits):
+        return deflate.DeflateIO(io.BytesIO(b), deflate.RAW, wbits).read()
+    def zopen(f, wbits):
+        return deflate.DeflateIO(f, deflate.RAW, wbits)
+    def compress(b, wbits):
+        s = io.BytesIO()
+        with deflate.DeflateIO(s, deflate.RAW, wbits, False) as d:
+            d.write(b)
+        return s.getvalue()
+    zlib_info = ('deflate', int(hasattr(deflate.DeflateIO, 'write')))
+except ImportError:
+    try:
+        import zlib
+    except ImportError:
+        try:
+            import uzlib as zlib
+        except ImportError:
+            zlib = None
+    def decompress(b, wbits):
+        return zlib.decompress(b, -wbits)
+    def zopen(f, wbits):
+        if hasattr(zlib, 'DecompIO'):
+            return zlib.DecompIO(f, -wbits)
+        import io
+        return io.BytesIO(decompress(f.read(), wbits))
+    zlib_info = ('zlib' if zlib else '-', 0)
+"""
+
+_transfers_funcs = """
+try:
+    from binascii import crc32
+except ImportError:
+    crc32 = lambda b: -1
+
+def _b64():
+    # (a2b_base64, b2a_base64), ImportError on ports without binascii
+    try:
+        from binascii import a2b_base64, b2a_base64
+    except ImportError:
+        from ubinascii import a2b_base64, b2a_base64
+    return a2b_base64, b2a_base64
+
+def transfer_info():
+    # base64 frames supported? stdin receiver (fput) supported?
+    try:
+        _b64()
+        b64 = 1
+    except ImportError:
+        b64 = 0
+    print(b64, int(hasattr(sys.stdin, 'buffer')))
+
+def fget(path, chunk_size=0, wbits=0):
+    b2a_base64 = _b64()[1]
+    if chunk_size <= 0:
+        gc.collect()
+        chunk_size = max(256, min(4096, gc.mem_free() // 8))
+    buf = bytearray(chunk_size)
+    mv = memoryview(buf)
+    with open(path, 'rb') as f:
+        while True:
+            n = f.readinto(buf)
+            if not n: break
+            b = mv[:n]
+            c = compress(b, wbits) if wbits else b
+            k = 'z'
+            if len(c) >= n:
+                c, k = b, 'b'
+            print(k, n, crc32(b), b2a_base64(c).decode(), sep=',', end='')
+    print('E')
+
+def _blocks(window, wbits):
+    # yield (kind, data) for blocks received from stdin
+    a2b_base64 = _b64()[0]
+    inp = sys.stdin.buffer
+    def read(n):
+        b = inp.read(n)
+        while len(b) < n:
+            b += inp.read(n - len(b))
+        return b
+    sys.stdout.write('\x01')
+    while True:
+        h = read(5)
+        n = int(h[1:].decode(), 16)
+        if not n: return
+        b = read(min(n, window - 5))
+        sys.stdout.write('\x01')
+        while len(b) < n:
+            b += read(min(n - len(b), window))
+            sys.stdout.write('\x01')
+        b = a2b_base64(b)
+        if h[0] == 122:
+            # 'z'
+            b = decompress(b, wbits)
+        yield h[0], b
+
+def fput(path, window, wbits):
+    with open(path, 'wb') as f:
+        for kind, b in _blocks(window, wbits):
+            f.write(b)
+
+def fput_bundle(window, wbits):
+    f = path = None
+    status = []
+    dirs = set()
+    def close():
+        if f:
+            f.close()
+            status.append('OK ' + path)
+    for kind, b in _blocks(window, wbits):
+        if kind == 112:
+            # 'p' path of next file
+            close()
+            f, path = None, b.decode()
+            try:
+                d = path[:path.rfind('/')]
+                if d and not d in dirs:
+                    makedirs(d)
+                    dirs.add(d)
+                f = open(path, 'wb')
+            except OSError as e:
+                status.append('E{} {}'.format(e.args[0], path))
+        elif f:
+            try:
+                f.write(b)
+            except OSError as e:
+                f.close()
+                f = None
+                status.append('E{} {}'.format(e.args[0], path))
+    close()
+    for s in status:
+        print(s)
+
+def _copy(f, g):
+    buf = bytearray(512)
+    mv = memoryview(buf)
+    while True:
+        n = f.readinto(buf)
+        if not n: break
+        g.write(mv[:n])
+
+def zip_file(src, dst, wbits):
+    with open(src, 'rb') as f:
+        with open(dst, 'wb') as g:
+            with deflate.DeflateIO(g, deflate.RAW, wbits, False) as d:
+                _copy(f, d)
+
+def unzip_file(src, dst, wbits):
+    with open(src, 'rb') as f:
+        with open(dst, 'wb') as g:
+            _copy(zopen(f, wbits), g)
+    os.remove(src)
+"""
+
+
+###############################################################################
+# Library
+
+HELPERS = _imports + _files_funcs + _time_funcs + _listing_funcs + _compression_funcs + _transfers_funcs
+
+VERSION = sha1(HELPERS.encode()).hexdigest()[:12]
+
+HELPERS += f"__ver__ = {repr(VERSION)}\n"
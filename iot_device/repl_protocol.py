@@ -2,11 +2,16 @@ from .eval import RemoteError
 from .eval_rsync import EvalRsync
 from .pyboard import PyboardError
 from .pydevice import Pydevice
+from .eval_file_ops import ZLIB_WBITS
 from websocket import WebSocketException
-import logging, os, time
+from binascii import b2a_base64
+import logging, os, time, zlib
 
 logger = logging.getLogger(os.path.splitext(os.path.basename(__file__))[0])
 
+# bytes of file data per fput block (before compression)
+_FPUT_BLOCK_SIZE = 2048
+
 class ReplProtocol(EvalRsync):
     """Concrete class of Eval (implements exec etc)"""
 
@@ -14,6 +19,13 @@ class ReplProtocol(EvalRsync):
         super().__init__(device)
         self.pyboard = Pydevice(device)
         self.pyboard.enter_raw_repl(soft_reset=False)
+        device.verify(self)
+
+    def unread(self) -> bytes:
+        """Output received from the device but not consumed by the protocol
+        (e.g. the raw repl prompt), for callers that read from the device
+        directly afterwards."""
+        return self.pyboard.serial.drain()
 
     def close(self):
         # CircuitPython resets when exiting raw repl (ugh!)
@@ -31,10 +43,118 @@ class ReplProtocol(EvalRsync):
         except PyboardError as e:
             raise RemoteError(*e.args)
 
+    def fput(self, host_file:str, mcu_file:str, chunk_size:int=256, data_consumer=None):
+        """Copy from host to microcontroller.
+        Streams the file in base64 encoded blocks, compressed if supported
+        by the mcu, to a receiver on the mcu that reads from stdin, all in
+        a single exec. chunk_size is the flow control window.
+        Falls back to EvalFileOps.fput on ports without sys.stdin.buffer
+        or binascii.
+        Returns the number of (compressed) bytes transferred.
+        """
+        if not self._transfer_info()[1]:
+            return super().fput(host_file, mcu_file, chunk_size, data_consumer)
+        self.makedirs(os.path.dirname(mcu_file))
+        if not os.path.isfile(host_file): return 0
+        window = max(chunk_size, 16)
+        return self._fput_run(f"fput({mcu_file!r}, {window}, {ZLIB_WBITS})",
+            [ (host_file, None) ], window, data_consumer)[0]
+
+    def fput_bundle(self, files, chunk_size:int=256, data_consumer=None):
+        """Copy list of (host_file, mcu_file) to microcontroller.
+        Streams all files to a single receiver on the mcu that creates
+        folders as needed and reports the status of each file.
+        Returns (bytes transferred, dict mcu_file -> error message).
+        """
+        if not self._transfer_info()[1]:
+            return super().fput_bundle(files, chunk_size, data_consumer)
+        files = [ (h, m) for h, m in files if os.path.isfile(h) ]
+        if not files: return 0, {}
+        window = max(chunk_size, 16)
+        sent, out = self._fput_run(f"fput_bundle({window}, {ZLIB_WBITS})", files, window, data_consumer)
+        errors = {}
+        for line in out.decode().splitlines():
+            status, _, path = line.partition(' ')
+            if status != 'OK':
+                errors[path] = status
+        return sent, errors
+
+    def _fput_run(self, cmd, files, window, data_consumer):
+        # Run receiver cmd and stream files to it.
+        # Returns (bytes sent, output of receiver).
+        compress = self.compression()[0] != ''
+        return self._with_helpers(lambda: self._fput_stream(cmd, files, window, compress, data_consumer))
+
+    def _fput_stream(self, cmd, files, window, compress, data_consumer):
+        # Each block is a 5 byte header (kind, 4 hex digits length) followed by
+        # base64 encoded data. Kinds: b data, z compressed data, p path of next
+        # file (bundles only). Blocks are sent in slices of at most window bytes,
+        # the receiver requests each slice with \x01 (same as raw-paste mode).
+        pyb = self.pyboard
+        sent = 0
+        try:
+            pyb.exec_raw_no_follow(f"exec({repr(cmd)}, __iot49__)")
+            self.device.use_raw_paste = pyb.use_raw_paste
+            n = 1
+            for host_file, mcu_file in files:
+                if mcu_file:
+                    self._fput_block(b'p', mcu_file.encode(), window)
+                with open(host_file, 'rb') as f:
+                    while True:
+                        data = f.read(_FPUT_BLOCK_SIZE)
+                        if not data: break
+                        kind = b'b'
+                        if compress:
+                            c = zlib.compressobj(9, zlib.DEFLATED, -ZLIB_WBITS)
+                            z = c.compress(data) + c.flush()
+                            if len(z) < len(data):
+                                data, kind = z, b'z'
+                        sent += len(data)
+                        self._fput_block(kind, data, window)
+                        if data_consumer and n > 2:
+                            data_consumer('.')
+                        n += 1
+            self._fput_ack()
+            pyb.serial.write(b'e0000')
+            out, err = pyb.follow(10)
+        except OSError as e:
+            raise RemoteError("Device disconnected")
+        except PyboardError as e:
+            raise RemoteError(*e.args)
+        if err:
+            raise RemoteError(err.decode())
+        return sent, out
+
+    def _fput_block(self, kind, data, window):
+        data = kind + b'%04x' % (4 * ((len(data) + 2) // 3)) + b2a_base64(data, newline=False)
+        for i in range(0, len(data), window):
+            self._fput_ack()
+            self.pyboard.serial.write(data[i:i+window])
+
+    def _fput_ack(self, timeout=10):
+        # wait for receiver to request the next slice
+        pyb = self.pyboard
+        out = b''
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            b = pyb.serial.read(1)
+            if b == b'\x01':
+                return
+            if b == b'\x04':
+                # receiver exited, collect error message
+                err = pyb.read_until(1, b'\x04', timeout)
+                raise RemoteError(err[:-1].decode())
+            out += b
+        # out of sync, get back to raw repl prompt
+        pyb.enter_raw_repl(soft_reset=False)
+        raise RemoteError(f"fput: no response from receiver ({out})")
+
     def abort(self) -> None:
         self.pyboard.abort()
 
     def softreset(self) -> None:
+        # reset clears helpers on mcu
+        self.device.helpers_version = None
         try:
             self.pyboard.softreset()
         except WebSocketException as e:
@@ -46,4 +166,5 @@ class ReplProtocol(EvalRsync):
             raise RemoteError(*e.args)
 
     def hardreset(self, printer, timeout) -> None:
-        self.pyboard.hardreset(printer, timeout)
\ No newline at end of file
+        self.device.helpers_version = None
+        self.pyboard.hardreset(printer, timeout)
@@ -1,11 +1,46 @@
 from .env import Env
+import os, threading
 
 
 class Secrets:
+    """Settings from Env.iot_secrets() (a python file).
+
+    The file is executed once and again only if its mtime or size changes.
+    """
+
+    _lock = threading.Lock()
+    _signature = None
+    _values = {}
 
     @staticmethod
     def get_attr(name, default=None):
-        with open(Env.iot_secrets()) as f:
-            cfg = {}
-            exec(f.read(), cfg)
-        return cfg.get(name, default)
+        return Secrets._load().get(name, default)
+
+    @staticmethod
+    def get(name, default=None, type=None):
+        """Value of name converted to type (e.g. int), default if not defined.
+        Raises ValueError if the value cannot be converted."""
+        value = Secrets._load().get(name)
+        if value is None:
+            return default
+        if type is None or isinstance(value, type):
+            return value
+        try:
+            return type(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"Secrets: {name} = {value!r} is not a valid {type.__name__}")
+
+    @staticmethod
+    def _load():
+        file = Env.expand_path(Env.iot_secrets())
+        st = os.stat(file)
+        signature = (file, st.st_mtime_ns, st.st_size)
+        with Secrets._lock:
+            if signature != Secrets._signature:
+                with open(file) as f:
+                    cfg = {}
+                    exec(f.read(), cfg)
+                cfg.pop('__builtins__', None)
+                Secrets._values = cfg
+                Secrets._signature = signature
+            return Secrets._values
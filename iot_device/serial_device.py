@@ -4,14 +4,14 @@ from .repl_protocol import ReplProtocol
 from .pyboard import PyboardError
 
 from serial import Serial, SerialException
-import os, time, logging
+import os, select, time, logging
 
 logger = logging.getLogger(os.path.splitext(os.path.basename(__file__))[0])
 
 class SerialDevice(Device):
 
-    def __init__(self, url):
-        super().__init__(url)
+    def __init__(self, url, hint=None):
+        super().__init__(url, hint)
 
     def read(self, size):
         return self.__serial.read(size)
@@ -19,9 +19,29 @@ class SerialDevice(Device):
     def write(self, data):
         return self.__serial.write(data)
 
+    def readinto(self, buf):
+        n = min(len(buf), self.__serial.in_waiting)
+        if n <= 0: return 0
+        return self.__serial.readinto(memoryview(buf)[:n])
+
     def inWaiting(self):
         return self.__serial.in_waiting
 
+    def wait_readable(self, timeout):
+        try:
+            r, _, _ = select.select([self.__serial], [], [], timeout)
+            return bool(r)
+        except (AttributeError, TypeError):
+            # no fileno (e.g. Windows)
+            return super().wait_readable(timeout)
+
+    def fileno(self):
+        try:
+            return self.__serial.fileno()
+        except AttributeError:
+            # no fileno (e.g. Windows)
+            return None
+
     def __enter__(self):
         try:
             self.__serial = Serial(self.address, 115200, parity='N',
@@ -3,64 +3,62 @@ from .eval import RemoteError
 from .repl_protocol import ReplProtocol
 
 from telnetlib import Telnet
-from collections import deque
 import os, select, time, logging
 
 logger = logging.getLogger(os.path.splitext(os.path.basename(__file__))[0])
 
 class TelnetDevice(Device):
 
-    def __init__(self, url):
+    def __init__(self, url, hint=None):
         self.use_raw_paste = False
-        self.fifo = deque()
+        self.fifo = bytearray()
         self.read_timeout = 10
-        super().__init__(url)
+        super().__init__(url, hint)
 
     def read(self, size=1):
+        deadline = None if self.read_timeout is None else time.monotonic() + self.read_timeout
         while len(self.fifo) < size:
-            timeout_count = 0
             data = self.__telnet.read_eager()
             if len(data):
-                self.fifo.extend(data)
-                timeout_count = 0
+                self.fifo += data
+            elif deadline is not None and time.monotonic() > deadline:
+                break
             else:
-                time.sleep(0.1)
-                if self.read_timeout is not None and timeout_count > 4 * self.read_timeout:
-                    break
-                timeout_count += 1
-
-        data = b""
-        while len(data) < size and len(self.fifo) > 0:
-            data += bytes([self.fifo.popleft()])
+                select.select([self.__telnet], [], [], 0.1)
+        data = bytes(self.fifo[:size])
+        del self.fifo[:size]
         return data
 
     def write(self, data):
         if len(data) < 220:
-            return self.__telnet.write(data)
+            self.__telnet.write(data)
+            return len(data)
         # slow to avoid communication errors
         # (esp32 notify buffer overflow)
         chunk_size = 64
-        n = 0
         for i in range(0, len(data), chunk_size):
-            n += self.__telnet.write(data[i:min(i+chunk_size, len(data))])
-            if n < len(data):
+            self.__telnet.write(data[i:min(i+chunk_size, len(data))])
+            if i + chunk_size < len(data):
                 time.sleep(0.2)
-        return n
-
-        self.__telnet.write(data)
         return len(data)
 
     def inWaiting(self):
-        n_waiting = len(self.fifo)
-        if not n_waiting:
-            data = self.__telnet.read_eager()
-            self.fifo.extend(data)
-            return len(data)
-        else:
-            return n_waiting
+        if not self.fifo:
+            self.fifo += self.__telnet.read_eager()
+        return len(self.fifo)
+
+    def wait_readable(self, timeout):
+        if self.fifo:
+            return True
+        r, _, _ = select.select([self.__telnet], [], [], timeout)
+        return bool(r)
+
+    def fileno(self):
+        return self.__telnet.fileno()
 
     def __enter__(self):
         addr, port = self.address.split(':')
+        self.fifo = bytearray()
         self.__telnet = Telnet(addr, port, timeout=15)
         print(f"TelnetDevice({addr}, {port}) - enter")
         self._repl_protocol = ReplProtocol(self)
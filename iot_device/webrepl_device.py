@@ -4,28 +4,53 @@ from .eval import RemoteError
 from .repl_protocol import ReplProtocol
 
 from websocket import create_connection, WebSocketException
-import os, time, logging, select
+import os, ssl, time, logging, select
 
 logger = logging.getLogger(os.path.splitext(os.path.basename(__file__))[0])
 
 class WebreplDevice(Device):
 
-    def __init__(self, url):
+    def __init__(self, url, hint=None):
         self.use_raw_paste = False
-        super().__init__(url)
+        self.fifo = bytearray()
+        self.read_timeout = 10
+        super().__init__(url, hint)
 
     def inWaiting(self):
-        r,_,_ = select.select([self.__ws], [], [], 0.1)
-        return 1 if r else 0
+        if not self.fifo:
+            if self._pending():
+                self._recv()
+            else:
+                r,_,_ = select.select([self.__ws], [], [], 0)
+                if r: self._recv()
+        return len(self.fifo)
+
+    def wait_readable(self, timeout):
+        if self.fifo or self._pending():
+            return True
+        r,_,_ = select.select([self.__ws], [], [], timeout)
+        return bool(r)
+
+    def _pending(self):
+        # data decrypted by ssl (wss) but not read, does not make the socket readable
+        sock = self.__ws.sock
+        return isinstance(sock, ssl.SSLSocket) and sock.pending() > 0
 
     def read(self, size=1):
-        res = b''
-        while len(res) < size:
-            r,_,_ = select.select([self.__ws], [], [], 0.1)
-            if r: res += self.__ws.recv().encode()
-            if len(res) >= size:
-                return res
-            time.sleep(0.01)
+        deadline = None if self.read_timeout is None else time.monotonic() + self.read_timeout
+        while len(self.fifo) < size:
+            r = self._pending() or select.select([self.__ws], [], [], 0.1)[0]
+            if r:
+                self._recv()
+            elif deadline is not None and time.monotonic() > deadline:
+                break
+        data = bytes(self.fifo[:size])
+        del self.fifo[:size]
+        return data
+
+    def _recv(self):
+        msg = self.__ws.recv()
+        self.fifo += msg.encode() if isinstance(msg, str) else msg
 
     def write(self, data):
         if len(data) < 252:
@@ -40,13 +65,19 @@ class WebreplDevice(Device):
                 time.sleep(0.5)
         return n
 
+    def fileno(self):
+        # Not suitable for event loops: ws.recv blocks until a frame is
+        # complete, and data buffered by ssl does not make the socket readable.
+        return None
+
     def __enter__(self):
         try:
+            self.fifo = bytearray()
             self.__ws = create_connection(self.url, 3)
             self.__ws.settimeout(100)
             p = b'Password: '
             pp = self.read(len(p))
-            self.write(Secrets.get_attr('webrepl_pwd', '?').encode())
+            self.write(Secrets.get('webrepl_pwd', '?', str).encode())
             self.write(b'\r\n')
         except WebSocketException as e:
             raise RemoteError(f"Websocket exception: {e}")
@@ -6,8 +6,8 @@ from iot_device import version
 install_requires = [
     "pyserial",
     "termcolor",
-    "pyopenssl",
-    "zeroconf",
+    "cryptography>=42",
+    "zeroconf>=0.39",
     "websocket-client",
     "PyYAML",
 ]
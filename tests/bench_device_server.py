@@ -0,0 +1,170 @@
+"""Startup time, reconnect latency and throughput of DeviceServer,
+the latter with a pty-backed fake device.
+
+    python tests/bench_device_server.py [MB]
+
+The "microcontroller" end of the pty is driven by a thread that streams
+data to the server (download) or drains what the client sends (upload).
+"""
+
+import os, sys, json, select, shutil, ssl, socket, tempfile, threading, time, tty, fcntl, termios, struct
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+PORT = 34599
+PASSWORD = 'bench'
+
+secrets = tempfile.NamedTemporaryFile('w', suffix='.py', delete=False)
+secrets.write(f"server_port = {PORT}\npassword = {PASSWORD!r}\n")
+secrets.close()
+os.environ['IOT_SECRETS'] = secrets.name
+# certificate is generated here
+os.environ['IOT_CACHE'] = tempfile.mkdtemp()
+
+from iot_device.device_server import DeviceServer
+
+
+class PtyDevice:
+    """Minimal device on the master side of a pty"""
+
+    uid = 'bench'
+    url = 'pty://bench'
+
+    def __init__(self):
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        os.set_blocking(self.master, False)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def fileno(self):
+        return self.master
+
+    def inWaiting(self):
+        return struct.unpack('i', fcntl.ioctl(self.master, termios.FIONREAD, b'\0\0\0\0'))[0]
+
+    def read(self, size):
+        try:
+            return os.read(self.master, size)
+        except BlockingIOError:
+            return b''
+
+    def readinto(self, buf):
+        try:
+            return os.readv(self.master, [buf])
+        except BlockingIOError:
+            return 0
+
+    def write(self, data):
+        data = memoryview(data)
+        while data:
+            try:
+                data = data[os.write(self.master, data):]
+            except BlockingIOError:
+                select.select([], [self.master], [])
+
+
+class Registry:
+
+    def __init__(self):
+        self.device = PtyDevice()
+
+    def get_device(self, uid):
+        return self.device
+
+
+context = ssl.create_default_context()
+context.check_hostname = False
+context.verify_mode = ssl.CERT_NONE
+
+def connect(session=None):
+    s = context.wrap_socket(socket.create_connection(('127.0.0.1', PORT)), session=session)
+    s.sendall(json.dumps({ 'uid': 'bench', 'password': PASSWORD }).encode())
+    ans = s.recv(100)
+    assert ans == b'ok', ans
+    return s
+
+
+def startup():
+    # first start generates the certificate, later starts load it
+    for name in [ 'first start', 'restart' ]:
+        t0 = time.perf_counter()
+        DeviceServer(Registry())
+        print(f"{name:16}: {1e3*(time.perf_counter()-t0):8.1f} ms")
+
+
+def reconnect(n=50):
+    # connect and authenticate n times, full handshakes versus resumed sessions
+    for resume in [ False, True ]:
+        session = None
+        resumed = 0
+        t0 = time.perf_counter()
+        for _ in range(n):
+            s = connect(session)
+            resumed += s.session_reused
+            if resume: session = s.session
+            s.close()
+        dt = (time.perf_counter() - t0) / n
+        name = 'resumed' if resume else 'full handshake'
+        print(f"{name:16}: {1e3*dt:8.2f} ms per connection ({resumed}/{n} resumed)")
+
+
+def download(device, size):
+    s = connect()
+    def mcu():
+        block = bytes(range(256)) * 256
+        sent = 0
+        while sent < size:
+            sent += os.write(device.slave, block[:size-sent])
+    t0 = time.perf_counter()
+    threading.Thread(target=mcu, daemon=True).start()
+    received = 0
+    buf = bytearray(256*1024)
+    while received < size:
+        received += s.recv_into(buf)
+    dt = time.perf_counter() - t0
+    s.close()
+    return dt
+
+
+def upload(device, size):
+    s = connect()
+    done = threading.Event()
+    def mcu():
+        received = 0
+        while received < size:
+            received += len(os.read(device.slave, 64*1024))
+        done.set()
+    threading.Thread(target=mcu, daemon=True).start()
+    t0 = time.perf_counter()
+    block = bytes(64*1024)
+    sent = 0
+    while sent < size:
+        sent += s.send(block[:size-sent])
+    done.wait()
+    dt = time.perf_counter() - t0
+    s.close()
+    return dt
+
+
+def main():
+    size = int(float(sys.argv[1] if len(sys.argv) > 1 else 64) * 1024 * 1024)
+    startup()
+    registry = Registry()
+    threading.Thread(target=DeviceServer(registry).serve, daemon=True).start()
+    time.sleep(1)
+    reconnect()
+    for name, f in [ ('device -> client', download), ('client -> device', upload) ]:
+        dt = f(registry.device, size)
+        print(f"{name:16}: {size/dt/1e6:8.1f} MB/s ({size/1e6:.0f} MB in {dt:.2f} s)")
+        time.sleep(0.2)
+    os.unlink(secrets.name)
+    shutil.rmtree(os.environ['IOT_CACHE'])
+
+
+if __name__ == '__main__':
+    main()
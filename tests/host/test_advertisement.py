@@ -0,0 +1,38 @@
+import pytest
+from iot_device.discover_broadcasts import parse_advertisement
+
+# advertisements broadcast by devices (DiscoverBroadcasts)
+
+
+def test_two_line_advertisement():
+    # sent by devices before metadata was added
+    assert parse_advertisement(b'ws://10.0.0.5:8266\n30:ae:a4:12:34:56') == \
+        ('ws://10.0.0.5:8266', { 'uid': '30:ae:a4:12:34:56' })
+
+def test_metadata():
+    url, info = parse_advertisement(
+        b'ws://10.0.0.5:8266\nuid1\nimplementation=micropython\nplatform=esp32\n'
+        b'mem_free=81920\ngeneration=7\nnote=a=b\n')
+    assert url == 'ws://10.0.0.5:8266'
+    assert info == { 'uid': 'uid1', 'implementation': 'micropython', 'platform': 'esp32',
+        'mem_free': 81920, 'generation': 7, 'note': 'a=b' }
+
+def test_crlf_and_blank_lines():
+    url, info = parse_advertisement(b'ws://h:8266\r\n uid1 \r\n\r\nplatform=rp2\r\n')
+    assert url == 'ws://h:8266'
+    assert info == { 'uid': 'uid1', 'platform': 'rp2' }
+
+@pytest.mark.parametrize('data', [
+    b'',
+    b'ws://h:8266',
+    b'ws://h:8266\n   ',
+    b'no url\nuid1',
+    b'ws://h:8266\nuid1\nmem_free=lots',
+])
+def test_malformed(data):
+    with pytest.raises(ValueError):
+        parse_advertisement(data)
+
+def test_not_utf8():
+    with pytest.raises(UnicodeError):
+        parse_advertisement(b'ws://h:8266\n\xff\xfe')
@@ -0,0 +1,49 @@
+import os, stat
+import pytest
+from iot_device.certificate import key_cert_file
+
+# server certificate in a temporary IOT_CACHE
+
+
+@pytest.fixture(autouse=True)
+def cache(tmp_path, monkeypatch):
+    monkeypatch.setenv('IOT_CACHE', str(tmp_path))
+
+def mode(file):
+    return stat.S_IMODE(os.stat(file).st_mode)
+
+
+def test_created_for_owner_only():
+    file = key_cert_file()
+    assert mode(file) == 0o600
+    with open(file) as f:
+        pem = f.read()
+    assert 'PRIVATE KEY' in pem and 'CERTIFICATE' in pem
+
+def test_reused():
+    file = key_cert_file()
+    with open(file, 'rb') as f:
+        pem = f.read()
+    assert key_cert_file() == file
+    with open(file, 'rb') as f:
+        assert f.read() == pem
+
+@pytest.mark.skipif(os.name != 'posix', reason='permissions')
+def test_permissions_restricted():
+    file = key_cert_file()
+    with open(file, 'rb') as f:
+        pem = f.read()
+    os.chmod(file, 0o644)
+    key_cert_file()
+    assert mode(file) == 0o600
+    with open(file, 'rb') as f:
+        assert f.read() == pem
+
+def test_unreadable_regenerated():
+    file = key_cert_file()
+    with open(file, 'w') as f:
+        f.write('garbage')
+    key_cert_file()
+    with open(file) as f:
+        assert 'CERTIFICATE' in f.read()
+    assert mode(file) == 0o600
@@ -0,0 +1,70 @@
+import time
+import pytest
+from iot_device.device_config import _ConfigStore
+
+# device configurations from yaml files in a temporary IOT_DEVICES, no devices required
+
+
+CONFIG = """
+a:
+    uid: 'aa'
+    install-dir: /flash
+    resources:
+        - main.py
+b:
+    uid: 'bb'
+    install-dir: /flash
+    resources:
+        - main.py
+c:
+    uid: 'cc'
+    install-dir: /lib
+    resources:
+        - main.py
+"""
+
+@pytest.fixture
+def devices(tmp_path, monkeypatch):
+    monkeypatch.setenv('IOT_DEVICES', str(tmp_path))
+    (tmp_path / 'devices.yaml').write_text(CONFIG)
+    return tmp_path
+
+@pytest.fixture
+def store(devices):
+    s = _ConfigStore()
+    s.CHECK_INTERVAL = 0.2
+    return s
+
+
+def test_lookup(store):
+    store.update()
+    assert set(store.by_name) == { 'a', 'b', 'c' }
+    assert store.by_uid['bb'].name == 'b'
+
+def test_reload_after_check_interval(store, devices):
+    store.update()
+    (devices / 'devices.yaml').write_text(CONFIG.replace("'cc'", "'cd'"))
+    # not checked again within CHECK_INTERVAL
+    assert 'cc' in store.update().by_uid
+    time.sleep(0.3)
+    assert 'cd' in store.update().by_uid and not 'cc' in store.by_uid
+
+def test_new_file_picked_up(store, devices):
+    store.update()
+    (devices / 'more.yml').write_text("d:\n    uid: dd\n")
+    time.sleep(0.3)
+    assert store.update().by_name['d'].uid == 'dd'
+
+def test_error_keeps_configuration(store, devices):
+    store.update()
+    (devices / 'bad.yaml').write_text("e:\n    resources: []\n")
+    time.sleep(0.3)
+    with pytest.raises(ValueError, match="'uid' is mandatory"):
+        store.update()
+    assert set(store.by_name) == { 'a', 'b', 'c' }
+
+def test_resource_key(store):
+    by_name = store.update().by_name
+    # same resources, different uid
+    assert by_name['a'].resource_key == by_name['b'].resource_key
+    assert by_name['a'].resource_key != by_name['c'].resource_key
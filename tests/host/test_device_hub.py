@@ -0,0 +1,203 @@
+import asyncio, threading, time
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from iot_device.device_server import _Hub, DeviceServer
+
+# _Hub and DeviceServer with a fake device, no network or devices required
+
+
+class FakeDevice:
+    """Device without file descriptor, output is sent by the test"""
+
+    uid = 'fake'
+    url = 'fake://1'
+
+    def __init__(self, exit_delay=0):
+        self.exit_delay = exit_delay
+        self.received = bytearray()
+        self.log = []
+        # __enter__ called while the previous __exit__ has not returned
+        self.overlap = False
+        self._exiting = False
+        self._output = bytearray()
+        self._lock = threading.Lock()
+        self._readable = threading.Event()
+
+    def __enter__(self):
+        self.overlap |= self._exiting
+        self.log.append('enter')
+        return self
+
+    def __exit__(self, *args):
+        self._exiting = True
+        time.sleep(self.exit_delay)
+        self.log.append('exit')
+        self._exiting = False
+
+    def fileno(self):
+        return None
+
+    def send(self, data):
+        # output of the "microcontroller"
+        with self._lock:
+            self._output += data
+            self._readable.set()
+
+    def wait_readable(self, timeout):
+        return self._readable.wait(timeout)
+
+    def inWaiting(self):
+        return len(self._output)
+
+    def readinto(self, buf):
+        with self._lock:
+            n = min(len(buf), len(self._output))
+            buf[:n] = self._output[:n]
+            del self._output[:n]
+            if not self._output:
+                self._readable.clear()
+            return n
+
+    def write(self, data):
+        with self._lock:
+            self.received += data
+
+
+def run(coro):
+    return asyncio.run(asyncio.wait_for(coro, 10))
+
+async def hub(device, keep_warm=10, executor=None):
+    h = _Hub(device, executor or ThreadPoolExecutor(4), 1024, 4, keep_warm)
+    await h.opened
+    return h
+
+async def receive(sub, size):
+    data = b''
+    while len(data) < size:
+        chunks = await sub.get()
+        assert chunks is not None
+        data += b''.join(chunks)
+    return data
+
+
+def test_fan_out():
+    async def main():
+        device = FakeDevice()
+        h = await hub(device)
+        a = h.subscribe(True, 4096)
+        b = h.subscribe(False, 4096)
+        device.send(b'hello world')
+        assert await receive(a, 11) == b'hello world'
+        assert await receive(b, 11) == b'hello world'
+        await h.close()
+    run(main())
+
+def test_unread_output_to_first_client():
+    # e.g. the raw repl prompt, read by __enter__ but not consumed
+    class Repl:
+        def unread(self):
+            return b'>'
+    class Device(FakeDevice):
+        def __enter__(self):
+            super().__enter__()
+            return Repl()
+    async def main():
+        device = Device()
+        h = await hub(device)
+        a = h.subscribe(True, 4096)
+        b = h.subscribe(False, 4096)
+        device.send(b'out')
+        assert await receive(a, 4) == b'>out'
+        assert await receive(b, 3) == b'out'
+        await h.close()
+    run(main())
+
+def test_writer_token():
+    async def main():
+        device = FakeDevice()
+        h = await hub(device)
+        a = h.subscribe(True, 4096)
+        b = h.subscribe(True, 4096)
+        c = h.subscribe(False, 4096)
+        assert a.writer and not b.writer and not c.writer
+        await h.write(a, b'from a')
+        await h.write(b, b'from b')
+        await h.write(c, b'from c')
+        assert b.ignored == 6 and c.ignored == 6
+        # token passes to the waiting writer
+        h.unsubscribe(a)
+        assert b.writer
+        await h.write(b, b', b')
+        for _ in range(100):
+            if device.received == b'from a, b': break
+            await asyncio.sleep(0.01)
+        assert device.received == b'from a, b'
+        await h.close()
+    run(main())
+
+def test_slow_subscriber_drops():
+    async def main():
+        device = FakeDevice()
+        h = await hub(device)
+        writer = h.subscribe(True, 64*1024)
+        slow = h.subscribe(False, 1000)
+        data = bytes(range(256)) * 40
+        for i in range(0, len(data), 512):
+            device.send(data[i:i+512])
+            # the writer keeps up, slow never reads
+            assert await receive(writer, 512) == data[i:i+512]
+        assert slow.dropped > 0
+        kept = b''.join(await slow.get())
+        assert len(kept) <= 1000 and slow.dropped + len(kept) == len(data)
+        assert data.endswith(kept)
+        await h.close()
+    run(main())
+
+def test_keep_warm():
+    async def main():
+        device = FakeDevice()
+        h = await hub(device, keep_warm=0.2)
+        closed = []
+        h.on_close = lambda: closed.append(True)
+        sub = h.subscribe(True, 4096)
+        h.unsubscribe(sub)
+        await asyncio.sleep(0.1)
+        # a client within keep_warm cancels the close
+        sub = h.subscribe(True, 4096)
+        await asyncio.sleep(0.2)
+        assert not h.closed
+        h.unsubscribe(sub)
+        await asyncio.wait_for(h.wait_closed(), 1)
+        assert closed and device.log == [ 'enter', 'exit' ]
+    run(main())
+
+def test_reopen_waits_for_close(tmp_path, monkeypatch):
+    # device is not opened again before the closing connection released it
+    monkeypatch.setenv('IOT_CACHE', str(tmp_path))
+    device = FakeDevice(exit_delay=0.3)
+    registry = type('Registry', (), { 'get_device': lambda self, uid: device })()
+    server = DeviceServer(registry)
+    async def main():
+        h1 = await server._DeviceServer__hub(device)
+        closing = asyncio.ensure_future(h1.close())
+        await asyncio.sleep(0.05)
+        h2 = await server._DeviceServer__hub(device)
+        assert h2 is not h1 and closing.done()
+        assert device.log == [ 'enter', 'exit', 'enter' ] and not device.overlap
+        await h2.close()
+    run(main())
+
+def test_idle_hubs_do_not_exhaust_executor():
+    # readers of devices without file descriptor do not hold threads of the shared pool
+    async def main():
+        executor = ThreadPoolExecutor(2)
+        devices = [ FakeDevice() for _ in range(4) ]
+        hubs = [ await hub(d, executor=executor) for d in devices ]
+        sub = hubs[-1].subscribe(True, 4096)
+        await hubs[-1].write(sub, b'x')
+        devices[-1].send(b'y')
+        assert await receive(sub, 1) == b'y'
+        for h in hubs:
+            await h.close()
+        assert all(d.log == [ 'enter', 'exit' ] for d in devices)
+    run(main())
@@ -0,0 +1,185 @@
+import threading, time
+import pytest
+from iot_device import device_registry
+from iot_device.device_registry import DeviceRegistry
+from iot_device.eval import RemoteError
+
+# DeviceRegistry with stub discovery sources and fake devices, no devices required
+
+
+class StubSource:
+    """Discovery source reporting the urls assigned by the test"""
+
+    def __init__(self, *args):
+        self.urls = set()
+
+    def scan(self):
+        return set(self.urls)
+
+    def hint(self, url):
+        return None
+
+    def info(self, url):
+        return {}
+
+
+class FakeConfig:
+
+    def __init__(self, key):
+        self.resource_key = key
+        self.resource_files = { '/main.py': (0, 1, '/host/main.py') }
+
+
+class FakeDevice:
+    """Registers without connecting, device name is the last part of the url"""
+
+    # url -> FakeConfig, ValueError if missing
+    configs = {}
+    # urls that cannot be contacted
+    offline = set()
+
+    def __init__(self, url, hint=None):
+        if url in self.offline:
+            raise RemoteError(f"{url} offline")
+        self.url = url
+        self.uid = self.name = url.split('/')[-1]
+        self.scheme = url.split('://')[0]
+        self.advertisement = {}
+
+    @property
+    def config(self):
+        config = self.configs.get(self.url)
+        if config is None:
+            raise ValueError(f"No configuration found for: '{self.name}'")
+        return config
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def rsync(self, data_consumer, host_files, **kwargs):
+        return { 'added': len(host_files) }
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    for name in ('DiscoverSerial', 'DiscoverBroadcasts', 'DiscoverMdns'):
+        monkeypatch.setattr(device_registry, name, StubSource)
+    monkeypatch.setattr(device_registry, 'find_device_class', lambda url: FakeDevice)
+    monkeypatch.setattr(FakeDevice, 'configs', {})
+    monkeypatch.setattr(FakeDevice, 'offline', set())
+    r = DeviceRegistry(scan_intervals={ 'serial': 0.05, 'broadcasts': 0.05, 'mdns': 0.05 })
+    yield r
+    r.close()
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition(): return True
+        time.sleep(0.01)
+    return False
+
+
+def test_rsync_all_reports_missing_configuration(registry):
+    FakeDevice.configs['serial://a'] = FakeConfig('k')
+    registry._sources['serial'].urls = { 'serial://a', 'serial://b' }
+    assert wait_for(lambda: len(registry.devices) == 2)
+    output = []
+    summaries = registry.rsync_all(['a', 'b'], data_consumer=output.append)
+    a, b = summaries
+    assert a['result'] == { 'added': 1 } and a['error'] is None
+    assert b['result'] is None and 'No configuration' in b['error']
+    assert 'b: FAILED' in ''.join(output)
+
+
+class Listener:
+
+    def __init__(self, registry):
+        self.registry = registry
+        self.urls = set()
+        # registry lock could be taken by another thread during every notification
+        self.unlocked = True
+
+    def _check_lock(self):
+        result = []
+        t = threading.Thread(target=lambda: result.append(self.registry.registration_stats))
+        t.start()
+        t.join(1)
+        self.unlocked &= bool(result)
+
+    def register_device(self, url, device):
+        self._check_lock()
+        self.urls.add(url)
+
+    def unregister_device(self, url):
+        self._check_lock()
+        self.urls.discard(url)
+
+
+def test_listeners_outside_lock(registry):
+    listener = Listener(registry)
+    registry.register('serial://a')
+    # called for devices registered before
+    registry.register_listener(listener)
+    registry._sources['serial'].urls = { 'serial://b' }
+    assert wait_for(lambda: listener.urls == { 'serial://a', 'serial://b' })
+    registry.unregister('a')
+    assert listener.urls == { 'serial://b' }
+    assert listener.unlocked
+
+def test_snapshot_consistent(registry):
+    listener = Listener(registry)
+    registry.register_listener(listener)
+    stop = threading.Event()
+    def churn():
+        for i in range(200):
+            registry.register(f"serial://d{i}")
+            if i >= 3:
+                registry.unregister(f"d{i-3}")
+        stop.set()
+    errors = []
+    def check():
+        while not stop.is_set():
+            s = registry._snapshot
+            indexed = [ { d for m in index.values() for d in m.values() } for index in (s.by_name, s.by_uid, s.by_url) ]
+            if any(devices != s.devices for devices in indexed):
+                errors.append(s)
+            dev = registry.get_device('d100')
+            if dev and dev.url != 'serial://d100':
+                errors.append(dev)
+    threads = [ threading.Thread(target=churn), threading.Thread(target=check) ]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    assert errors == []
+    urls = { f"serial://d{i}" for i in range(197, 200) }
+    assert { d.url for d in registry.devices } == urls
+    assert listener.urls == urls
+
+def test_backoff(registry):
+    registry.BACKOFF_MIN = 0.1
+    registry.BACKOFF_JITTER = 0
+    FakeDevice.offline.add('serial://x')
+    delays = []
+    for _ in range(3):
+        with pytest.raises(ValueError, match='offline'):
+            registry.register('serial://x')
+        count, delay, error = registry.registration_stats['failing']['serial://x']
+        assert count == len(delays) + 1 and 'offline' in error
+        delays.append(delay)
+        # skipped while backing off
+        registry.register('serial://x')
+        time.sleep(delay)
+    assert delays == pytest.approx([ 0.1, 0.2, 0.4 ], abs=0.05)
+    stats = registry.registration_stats
+    assert stats['attempts'] == stats['failed'] == 3 and stats['skipped'] == 3
+    # success resets
+    FakeDevice.offline.clear()
+    registry.register('serial://x')
+    assert registry.registration_stats['failing'] == {}
+    registry.unregister('x')
+    FakeDevice.offline.add('serial://x')
+    with pytest.raises(ValueError):
+        registry.register('serial://x')
+    assert registry.registration_stats['failing']['serial://x'][0] == 1
@@ -0,0 +1,58 @@
+import socket, time
+import pytest
+from zeroconf import Zeroconf, ServiceInfo
+from iot_device.discover_mdns import DiscoverMdns
+
+# zeroconf responder and browser on loopback, no network or devices required
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition(): return True
+        time.sleep(0.1)
+    return False
+
+@pytest.fixture
+def mdns():
+    d = DiscoverMdns(interfaces=['127.0.0.1'])
+    yield d
+    d.close()
+
+@pytest.fixture
+def responder():
+    zc = Zeroconf(interfaces=['127.0.0.1'])
+    yield zc
+    zc.close()
+
+def service(name, port, uid):
+    return ServiceInfo("_ws._tcp.local.", f"{name}._ws._tcp.local.",
+        addresses=[socket.inet_aton('127.0.0.1')], port=port,
+        properties={'uid': uid}, server=f"{name}.local.")
+
+
+def test_found_and_removed(mdns, responder):
+    info = service('board1', 8266, 'aa:bb')
+    responder.register_service(info)
+    assert wait_for(lambda: mdns.scan() == { 'ws://127.0.0.1:8266' })
+    assert mdns.hint('ws://127.0.0.1:8266') == 'aa:bb'
+    responder.unregister_service(info)
+    assert wait_for(lambda: not mdns.scan())
+    assert mdns.hint('ws://127.0.0.1:8266') is None
+
+def test_several_services(mdns, responder):
+    for i in range(3):
+        responder.register_service(service(f"board{i}", 8266+i, f"uid{i}"))
+    urls = { f"ws://127.0.0.1:{8266+i}" for i in range(3) }
+    assert wait_for(lambda: mdns.scan() == urls)
+
+def test_not_expired_by_clock(mdns, responder, monkeypatch):
+    # registered services stay until the browser reports them removed,
+    # e.g. not after the default TTL of 120 seconds
+    responder.register_service(service('board1', 8266, 'aa:bb'))
+    assert wait_for(lambda: mdns.scan())
+    later = time.monotonic() + 3600
+    monkeypatch.setattr(time, 'monotonic', lambda: later)
+    urls = mdns.scan()
+    monkeypatch.undo()
+    assert urls == { 'ws://127.0.0.1:8266' }
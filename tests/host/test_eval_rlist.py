@@ -0,0 +1,67 @@
+import io, os, contextlib
+import pytest
+from iot_device.eval_rlist import RlistOutput
+from iot_device.remote_lib import HELPERS
+
+# parse output of rlist (remote_lib), here run on the host
+
+
+@pytest.fixture
+def tree(tmp_path):
+    for f, data in [ ('a.py', 'a'), ('my file.txt', 'bb'), ('sub dir/c.py', 'ccc'), ('sub dir/x/ d .py', 'dddd') ]:
+        p = tmp_path / f
+        p.parent.mkdir(parents=True, exist_ok=True)
+        p.write_text(data)
+    return str(tmp_path)
+
+def rlist(path):
+    ns = {}
+    exec(HELPERS, ns)
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        ns['rlist'](path)
+    # as received from the raw repl
+    return out.getvalue().replace('\n', '\r\n').encode() + b'\x04'
+
+def parse(data, fragment):
+    out = RlistOutput()
+    for i in range(0, len(data), fragment):
+        out.data_consumer(data[i:i+fragment])
+    return out.files
+
+def sizes(files):
+    return { k: v[1] for k, v in files.items() }
+
+
+@pytest.mark.parametrize('fragment', [ 1, 2, 3, 7, 64, 10000 ])
+def test_fragmented(tree, fragment):
+    files = parse(rlist(tree), fragment)
+    assert sizes(files) == {
+        tree: -1,
+        f"{tree}/a.py": 1,
+        f"{tree}/my file.txt": 2,
+        f"{tree}/sub dir": -1,
+        f"{tree}/sub dir/c.py": 3,
+        f"{tree}/sub dir/x": -1,
+        f"{tree}/sub dir/x/ d .py": 4,
+    }
+    assert files[f"{tree}/a.py"][0] == pytest.approx(
+        RlistOutput.local2gmtime(os.stat(f"{tree}/a.py")[7]), abs=1)
+
+def test_single_file(tree):
+    assert sizes(parse(rlist(f"{tree}/a.py"), 5)) == { f"{tree}/a.py": 1 }
+
+def test_line_endings():
+    files = parse(b'D -1 0 /lib\r\nF 10 0 a b.py\nF 3 0 c.py\r\n\x04', 4)
+    assert sizes(files) == { '/lib': -1, '/lib/a b.py': 10, '/lib/c.py': 3 }
+
+def test_malformed_lines_skipped():
+    files = parse(b'Traceback\r\nD -1 0 /\r\nF x 0 bad.py\r\nF 1 0 ok.py\r\nF 1\r\n', 3)
+    assert sizes(files) == { '/': -1, '/ok.py': 1 }
+
+def test_incomplete_line_kept():
+    out = RlistOutput()
+    out.data_consumer(b'D -1 0 /lib\r\nF 10 0 a.p')
+    assert sizes(out.files) == { '/lib': -1 }
+    out.data_consumer(b'y\r\n')
+    assert sizes(out.files) == { '/lib': -1, '/lib/a.py': 10 }
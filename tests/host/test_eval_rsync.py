@@ -0,0 +1,128 @@
+from types import SimpleNamespace
+import pytest
+from iot_device.eval_rsync import EvalRsync, _in_tree
+from iot_device.manifest import Manifest
+
+# manifest and rsync listings with a stubbed mcu file system, no devices required
+
+
+class Mcu(EvalRsync):
+    """rlist and rstat of a file system dict path -> (mtime, size), size -1 for folders"""
+
+    def __init__(self, fs, generation=None):
+        device = SimpleNamespace(uid='aa:bb', name='mcu',
+            advertisement={ 'generation': generation } if generation is not None else {})
+        super().__init__(device)
+        self.fs = dict(fs)
+        # rlist: (path, mtime), rstat: list of paths
+        self.calls = []
+
+    def rlist(self, path='/', data_consumer=None, show=False, mtime=True):
+        self.calls.append(('rlist', path, mtime))
+        return { p: v if mtime or v[1] < 0 else (0, v[1]) for p, v in self.fs.items() if _in_tree(p, path) }
+
+    def rstat(self, paths, batch=200):
+        self.calls.append(('rstat', list(paths)))
+        return { p: self.fs[p] for p in paths if p in self.fs }
+
+    def exec(self, code, data_consumer=None, timeout=None):
+        raise NotImplementedError(code)
+
+    abort = softreset = hardreset = exec
+
+    def sync_time(self, tolerance=5):
+        pass
+
+
+FS = {
+    '/': (100, -1),
+    '/main.py': (10, 5),
+    '/lib': (100, -1),
+    '/lib/a.py': (20, 7),
+    '/lib/sub': (100, -1),
+    '/lib/sub/b.py': (30, 9),
+    '/data': (100, -1),
+    '/data/log.txt': (40, 11),
+}
+
+@pytest.fixture(autouse=True)
+def cache(tmp_path, monkeypatch):
+    monkeypatch.setenv('IOT_CACHE', str(tmp_path))
+
+def listed(mcu):
+    return [ c[1] for c in mcu.calls if c[0] == 'rlist' ]
+
+
+def test_manifest_persists():
+    m = Manifest('aa:bb')
+    assert m.files == {} and m.generation is None
+    m.save({ '/main.py': (10, 5, 'sha256:00') }, 7)
+    m = Manifest('aa:bb')
+    assert m.files == { '/main.py': (10, 5, 'sha256:00') } and m.generation == 7
+    m.clear()
+    assert Manifest('aa:bb').files == {}
+
+def test_unchanged_folders_not_listed():
+    mcu = Mcu(FS)
+    files = { p: v + ('sha256:' + p, ) for p, v in FS.items() }
+    result = mcu._refresh(files)
+    assert listed(mcu) == []
+    assert result == files
+
+def test_changed_folder_listed_once():
+    fs = dict(FS)
+    # file added to /lib/sub changes the mtime of /lib/sub only, but /lib is also touched
+    fs['/lib'] = (200, -1)
+    fs['/lib/sub'] = (200, -1)
+    fs['/lib/sub/new.py'] = (200, 3)
+    mcu = Mcu(fs)
+    result = mcu._refresh({ p: v + (None, ) for p, v in FS.items() })
+    # children of a listed folder are not listed again
+    assert listed(mcu) == [ '/lib' ]
+    assert result['/lib/sub/new.py'] == (200, 3)
+    assert set(result) == set(fs)
+
+def test_deleted_entries_removed():
+    fs = { p: v for p, v in FS.items() if not _in_tree(p, '/data') }
+    fs['/'] = (200, -1)
+    mcu = Mcu(fs)
+    result = mcu._refresh({ p: v + (None, ) for p, v in FS.items() })
+    assert not any(_in_tree(p, '/data') for p in result)
+
+def test_hash_kept_only_if_unchanged():
+    fs = dict(FS)
+    # same size, new mtime: content may have changed
+    fs['/main.py'] = (11, 5)
+    # same mtime, new size
+    fs['/lib/a.py'] = (20, 8)
+    mcu = Mcu(fs)
+    result = mcu._refresh({ p: v + ('sha256:' + p, ) for p, v in FS.items() })
+    assert result['/main.py'] == (11, 5, None)
+    assert result['/lib/a.py'] == (20, 8, None)
+    assert result['/lib/sub/b.py'] == (30, 9, 'sha256:/lib/sub/b.py')
+
+def test_generation_match_skips_listing():
+    Manifest('aa:bb').save({ p: v + (None, ) for p, v in FS.items() }, 3)
+    mcu = Mcu(FS, generation=3)
+    mcu.rsync(lambda s: None, host_files={})
+    assert mcu.calls == []
+    # other generation: stat the manifest entries
+    mcu = Mcu(FS, generation=4)
+    mcu.rsync(lambda s: None, host_files={})
+    assert [ c[0] for c in mcu.calls ] == [ 'rstat' ]
+
+def test_full_listing_without_manifest():
+    mcu = Mcu(FS)
+    mcu.rsync(lambda s: None, host_files={})
+    assert listed(mcu) == [ '/' ]
+    assert set(Manifest('aa:bb').files) == set(FS)
+
+@pytest.mark.parametrize('compare, mtime', [ ('time', True), ('hash', False) ])
+def test_file_mtimes_listed_for_time_compare(compare, mtime):
+    mcu = Mcu(FS)
+    mcu.rsync(lambda s: None, compare=compare, host_files={})
+    assert mcu.calls == [ ('rlist', '/', mtime) ]
+    fs = dict(FS, **{ '/lib': (200, -1) })
+    mcu = Mcu(fs)
+    mcu.rsync(lambda s: None, compare=compare, host_files={})
+    assert mcu.calls[1] == ('rlist', '/lib', mtime)
@@ -0,0 +1,87 @@
+import io, os, zlib, contextlib
+from binascii import b2a_base64
+import pytest
+from iot_device.eval_file_ops import FgetOutput, ZLIB_WBITS
+from iot_device.remote_lib import HELPERS
+
+# decode frames sent by fget (remote_lib), here run on the host
+
+
+def fget(path, chunk_size):
+    ns = {}
+    exec(HELPERS, ns)
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        ns['fget'](path, chunk_size)
+    # as received from the raw repl
+    return out.getvalue().replace('\n', '\r\n').encode() + b'\x04'
+
+def frame(kind, data, size=None, crc=None):
+    size = len(data) if size is None else size
+    crc = zlib.crc32(data) if crc is None else crc
+    if kind == b'z':
+        c = zlib.compressobj(9, zlib.DEFLATED, -ZLIB_WBITS)
+        data = c.compress(data) + c.flush()
+    return kind + b',%d,%d,' % (size, crc) + b2a_base64(data) 
+
+def decode(data, fragment=10000):
+    f = io.BytesIO()
+    out = FgetOutput(f)
+    for i in range(0, len(data), fragment):
+        out.data_consumer(data[i:i+fragment])
+    return out, f.getvalue()
+
+
+@pytest.mark.parametrize('fragment', [ 1, 3, 77, 10000 ])
+def test_fragmented(tmp_path, fragment):
+    data = os.urandom(1000)
+    (tmp_path / 'x.bin').write_bytes(data)
+    out, received = decode(fget(str(tmp_path / 'x.bin'), 256), fragment)
+    assert out.done and not out.error
+    assert received == data
+    assert out.frames == 4 and out.size == 1000
+
+def test_empty_file(tmp_path):
+    (tmp_path / 'x.bin').write_bytes(b'')
+    out, received = decode(fget(str(tmp_path / 'x.bin'), 256), 2)
+    assert out.done and not out.error and received == b''
+
+def test_compressed_frames():
+    data = b'hello world ' * 100
+    out, received = decode(frame(b'z', data) + frame(b'b', b'tail') + b'E\r\n\x04', 5)
+    assert out.done and not out.error
+    assert received == data + b'tail'
+    assert out.sent < len(data)
+
+def test_crc_not_available():
+    out, received = decode(frame(b'b', b'abc', crc=-1) + b'E\n')
+    assert out.done and not out.error and received == b'abc'
+
+def test_corrupt_crc():
+    out, received = decode(frame(b'b', b'abc') + frame(b'b', b'def', crc=1) + frame(b'b', b'ghi') + b'E\n')
+    assert out.error == 'frame 1 corrupted'
+    assert received == b'abc'
+
+def test_wrong_size():
+    out, _ = decode(frame(b'b', b'abc', size=4) + b'E\n')
+    assert out.error == 'frame 0 corrupted'
+
+def test_corrupt_base64():
+    out, received = decode(b'b,3,-1,YWJj*\r\n' + b'E\r\n')
+    assert out.error.startswith('malformed frame 0')
+    assert received == b''
+
+@pytest.mark.parametrize('line', [ b'b,1x,0,AA==', b'b,1,0x,AA==', b'b,,0,AA==' ])
+def test_corrupt_numbers(line):
+    out, received = decode(frame(b'b', b'abc') + line + b'\r\n' + b'E\r\n')
+    assert out.error.startswith('malformed frame 1')
+    assert received == b'abc'
+
+def test_corrupt_compressed_data():
+    out, _ = decode(b'z,3,-1,' + b2a_base64(b'not deflate') + b'E\n')
+    assert out.error.startswith('malformed frame 0')
+
+def test_incomplete_transfer():
+    out, received = decode(frame(b'b', b'abc') + b'b,3,-1,YW')
+    assert not out.done and not out.error
+    assert received == b'abc'
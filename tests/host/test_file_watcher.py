@@ -0,0 +1,94 @@
+import threading, time
+from types import SimpleNamespace
+import pytest
+from iot_device import file_watcher
+from iot_device.file_watcher import FileWatcher
+from iot_device.device_config import DeviceConfig
+from iot_device.eval_rsync import watch
+
+# file watcher (polling and inotify) and watch mode with stub connections, no devices required
+
+
+@pytest.fixture(params=[ 'poll', 'inotify' ])
+def backend(request, monkeypatch):
+    if request.param == 'poll':
+        def no_inotify(paths):
+            raise OSError("disabled by test")
+        monkeypatch.setattr(file_watcher, '_Inotify', no_inotify)
+    return request.param
+
+@pytest.fixture
+def projects(tmp_path, monkeypatch):
+    # two libraries, deployed to devices a and b respectively
+    for lib in ('lib_a', 'lib_b'):
+        (tmp_path / lib).mkdir()
+        (tmp_path / lib / 'x.py').write_text('x = 1\n')
+    (tmp_path / 'devices').mkdir()
+    (tmp_path / 'devices' / 'devices.yaml').write_text(f"""
+a:
+    uid: aa
+    path: {tmp_path}
+    resources:
+        - lib_a
+b:
+    uid: bb
+    path: {tmp_path}
+    resources:
+        - lib_b
+""")
+    monkeypatch.setenv('IOT_PROJECTS', str(tmp_path))
+    monkeypatch.setenv('IOT_DEVICES', str(tmp_path / 'devices'))
+    DeviceConfig.reload()
+    yield tmp_path
+    monkeypatch.undo()
+    DeviceConfig.reload()
+
+
+class Repl:
+    """Connection to a device with a configuration, records rsync and pushes"""
+
+    def __init__(self, name):
+        self.device = SimpleNamespace(name=name, config=DeviceConfig.get_device_config(name))
+        self.pushed = []
+
+    def rsync(self, data_consumer, **kwargs):
+        pass
+
+    def _push(self, updated, deleted, data_consumer):
+        self.pushed.append(dict(updated))
+
+
+def test_burst_reported_once(tmp_path, backend):
+    with FileWatcher([ str(tmp_path) ], debounce=0.3, poll_interval=0.05) as watcher:
+        assert watcher.wait(0.2) == set()
+        (tmp_path / 'a.py').write_text('a')
+        time.sleep(0.1)
+        (tmp_path / 'b.py').write_text('b')
+        changed = watcher.wait(2)
+        assert { str(tmp_path / 'a.py'), str(tmp_path / 'b.py') } <= changed
+        assert watcher.wait(0.5) == set()
+
+def test_hidden_files_ignored(tmp_path, backend):
+    with FileWatcher([ str(tmp_path) ], debounce=0.1, poll_interval=0.05) as watcher:
+        (tmp_path / '.swp').write_text('x')
+        assert watcher.wait(0.5) == set()
+
+def test_push_to_devices_with_changed_resource(projects, backend):
+    a, b = Repl('a'), Repl('b')
+    stop = threading.Event()
+    pushes = []
+    thread = threading.Thread(target=lambda: pushes.append(
+        watch([ a, b ], lambda s: None, debounce=0.1, poll_interval=0.05, stop=stop)))
+    thread.start()
+    try:
+        time.sleep(0.5)
+        (projects / 'lib_a' / 'x.py').write_text('x = 2\n')
+        deadline = time.monotonic() + 5
+        while not a.pushed and time.monotonic() < deadline:
+            time.sleep(0.05)
+    finally:
+        stop.set()
+        thread.join()
+    assert a.pushed == [ { '/x.py': str(projects / 'lib_a' / 'x.py') } ]
+    assert b.pushed == []
+    assert pushes == [ 1 ]
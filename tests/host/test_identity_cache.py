@@ -0,0 +1,90 @@
+import json, logging
+import pytest
+from iot_device import device
+from iot_device.device import Device
+from iot_device.identity_cache import IdentityCache
+
+# identities of devices created with a hint, fake device, no devices required
+
+
+class Repl:
+
+    def __init__(self, dev):
+        self._dev = dev
+
+    def exec(self, code, timeout=None):
+        self._dev.identified += 1
+        return self._dev.identity.encode()
+
+
+class FakeDevice(Device):
+
+    def __init__(self, url, hint=None, identity='aa:bb micropython esp32'):
+        # reported by the "mcu"
+        self.identity = identity
+        self.connects = 0
+        self.identified = 0
+        super().__init__(url, hint)
+
+    def read(self, size=1):
+        return b''
+
+    def write(self, data):
+        pass
+
+    def inWaiting(self):
+        return 0
+
+    def __enter__(self):
+        self.connects += 1
+        repl = Repl(self)
+        self.verify(repl)
+        return repl
+
+    def __exit__(self, *args):
+        pass
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    monkeypatch.setenv('IOT_CACHE', str(tmp_path))
+    c = IdentityCache()
+    monkeypatch.setattr(device, 'identity_cache', c)
+    return c
+
+
+def test_without_hint_connects(cache):
+    dev = FakeDevice('serial://a')
+    assert dev.connects == 1 and dev.uid == 'aa:bb'
+    assert cache.get('serial://a', None) is None
+
+def test_hint_cached_and_saved(cache):
+    dev = FakeDevice('serial://a', 'vid:pid:1')
+    assert dev.connects == 1
+    assert cache.get('serial://a', 'vid:pid:1') == ('aa:bb', 'micropython', 'esp32')
+    with open(cache.file) as f:
+        assert json.load(f) == { 'serial://a vid:pid:1': [ 'aa:bb', 'micropython', 'esp32' ] }
+    # another process
+    assert IdentityCache().get('serial://a', 'vid:pid:1') == ('aa:bb', 'micropython', 'esp32')
+
+def test_cache_hit_skips_connect(cache):
+    cache.put('serial://a', 'vid:pid:1', ('aa:bb', 'micropython', 'esp32'))
+    dev = FakeDevice('serial://a', 'vid:pid:1')
+    assert dev.connects == 0
+    assert (dev.uid, dev.implementation, dev.platform) == ('aa:bb', 'micropython', 'esp32')
+    # verified on first connection only
+    for _ in range(2):
+        with dev: pass
+    assert dev.identified == 1
+    # other hint (e.g. other board on the same port)
+    assert FakeDevice('serial://a', 'vid:pid:2').connects == 1
+
+def test_mismatch_updates_cache(cache, caplog):
+    cache.put('serial://a', 'vid:pid:1', ('old', 'micropython', 'esp32'))
+    dev = FakeDevice('serial://a', 'vid:pid:1', identity='new micropython esp32s3')
+    assert dev.uid == 'old'
+    with caplog.at_level(logging.WARNING):
+        with dev: pass
+    assert "expected ('old', 'micropython', 'esp32')" in caplog.text
+    assert (dev.uid, dev.platform) == ('new', 'esp32s3')
+    assert IdentityCache().get('serial://a', 'vid:pid:1') == ('new', 'micropython', 'esp32s3')
@@ -0,0 +1,78 @@
+import time
+from iot_device.read_buffer import ReadBuffer
+
+# ReadBuffer with a fake stream, no devices required
+
+
+class FakeStream:
+    """Delivers chunks of data at given times (seconds after creation)"""
+
+    def __init__(self, *chunks):
+        # [ (time, data), ... ]
+        self._chunks = list(chunks)
+        self._start = time.monotonic()
+        self._available = bytearray()
+
+    def _arrived(self):
+        now = time.monotonic() - self._start
+        while self._chunks and self._chunks[0][0] <= now:
+            self._available += self._chunks.pop(0)[1]
+
+    def inWaiting(self):
+        self._arrived()
+        return len(self._available)
+
+    def read(self, size=1):
+        self._arrived()
+        data = bytes(self._available[:size])
+        del self._available[:size]
+        return data
+
+
+class WaitingStream(FakeStream):
+
+    def wait_readable(self, timeout):
+        if self._chunks:
+            timeout = min(timeout, self._start + self._chunks[0][0] - time.monotonic())
+        time.sleep(max(0, timeout))
+        return self.inWaiting() > 0
+
+
+def test_ending_split_across_reads():
+    stream = WaitingStream((0, b'xxO'), (0.05, b'K\r'), (0.1, b'\nyy'))
+    buf = ReadBuffer(stream)
+    assert buf.read_until(1, b'OK\r\n', timeout=1) == b'xxOK\r\n'
+
+def test_leftover_returned_by_next_read():
+    buf = ReadBuffer(WaitingStream((0, b'abc>def>gh')))
+    assert buf.read_until(1, b'>', timeout=1) == b'abc>'
+    # remaining bytes were pulled from the stream with the first chunk
+    assert buf.inWaiting() == 6
+    assert buf.read_until(1, b'>', timeout=1) == b'def>'
+    assert buf.read(2) == b'gh'
+
+def test_data_consumer():
+    stream = WaitingStream((0, b'ab'), (0.05, b'cd'), (0.1, b'e\x04f'))
+    buf = ReadBuffer(stream)
+    consumed = []
+    data = buf.read_until(1, b'\x04', timeout=1, data_consumer=consumed.append)
+    assert b''.join(consumed) == b'abcde\x04'
+    # only the last chunk is returned
+    assert data == b'e\x04'
+    assert buf.read(1) == b'f'
+
+def test_deadline_reset_by_data():
+    # 0.6 seconds in total, but never more than 0.1 seconds without data
+    chunks = [ (0.1*i, b'.') for i in range(1, 6) ] + [ (0.6, b'\x04') ]
+    buf = ReadBuffer(WaitingStream(*chunks))
+    assert buf.read_until(1, b'\x04', timeout=0.25) == b'.....\x04'
+
+def test_deadline_expires():
+    buf = ReadBuffer(WaitingStream((0.05, b'partial'), (5, b'\x04')))
+    start = time.monotonic()
+    assert buf.read_until(1, b'\x04', timeout=0.2) == b'partial'
+    assert 0.2 <= time.monotonic() - start < 1
+
+def test_polls_without_wait_readable():
+    buf = ReadBuffer(FakeStream((0.05, b'ok>')))
+    assert buf.read_until(1, b'>', timeout=1) == b'ok>'
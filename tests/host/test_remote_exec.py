@@ -0,0 +1,56 @@
+import io, contextlib, traceback
+from types import SimpleNamespace
+import pytest
+from iot_device.eval import RemoteError
+from iot_device.eval_file_ops import EvalFileOps
+from iot_device.remote_lib import HELPERS
+
+# helper library on a simulated mcu (code runs on the host), no devices required
+
+
+class Mcu(EvalFileOps):
+
+    def __init__(self):
+        super().__init__(SimpleNamespace(uid='aa:bb'))
+        # globals of the "mcu"
+        self.ns = {}
+        self.uploads = 0
+
+    def exec(self, code, data_consumer=None, timeout=None):
+        if repr(HELPERS) in code:
+            self.uploads += 1
+        out = io.StringIO()
+        try:
+            with contextlib.redirect_stdout(out):
+                exec(code, self.ns)
+        except Exception:
+            raise RemoteError(traceback.format_exc(limit=0))
+        return out.getvalue().encode()
+
+    abort = softreset = hardreset = exec
+
+
+def test_uploaded_once():
+    mcu = Mcu()
+    assert mcu._remote_exec("print(__ver__)") == mcu._remote_exec("print(__ver__)")
+    assert mcu.uploads == 1
+
+def test_reuploaded_when_lost():
+    mcu = Mcu()
+    mcu._remote_exec("print(1)")
+    # e.g. machine.soft_reset() in user code
+    mcu.ns.clear()
+    assert mcu._remote_exec("print(2)") == b'2\n'
+    assert mcu.uploads == 2
+
+def test_other_errors_raised():
+    mcu = Mcu()
+    with pytest.raises(RemoteError, match="NameError"):
+        mcu._remote_exec("print(undefined)")
+    with pytest.raises(RemoteError, match="ZeroDivisionError"):
+        mcu._remote_exec("1/0")
+    assert mcu.uploads == 1
+
+def test_fput_missing_host_file(tmp_path):
+    # same result as the streaming fput of ReplProtocol
+    assert Mcu().fput(str(tmp_path / 'missing.py'), str(tmp_path / 'lib' / 'x.py')) == 0
@@ -0,0 +1,104 @@
+import os
+import pytest
+from iot_device.device_config import _Resource, _include_matcher, _exclude_matcher
+
+# include & exclude patterns of resources, compared to glob semantics
+
+
+class Dev:
+    def __init__(self, **spec):
+        self._spec = spec
+
+def scan(root, name='lib', **param):
+    res = _Resource(Dev(path=str(root)), { name: param or None })
+    return sorted(os.path.relpath(f, name) for f in res.scan())
+
+@pytest.fixture
+def tree(tmp_path):
+    files = [
+        'lib/a.py', 'lib/b.mpy', 'lib/c.txt', 'lib/boot_out.txt', 'lib/.hidden.py',
+        'lib/x/d.py', 'lib/x/y/e.py', 'lib/x/y/z/f.py', 'lib/x/.git/g.py',
+        'lib/data/h.py', 'lib/x/data/i.py', 'lib/x/notes.txt',
+    ]
+    for f in files:
+        p = tmp_path / f
+        p.parent.mkdir(parents=True, exist_ok=True)
+        p.write_text(f)
+    return tmp_path
+
+
+def test_default_patterns(tree):
+    assert scan(tree) == [
+        'a.py', 'b.mpy', 'data/h.py', 'x/d.py', 'x/data/i.py', 'x/y/e.py', 'x/y/z/f.py' ]
+
+def test_double_star_at_depth_0():
+    match, depth = _include_matcher('**/*.py')
+    assert match('a.py') and match('x/a.py') and match('x/y/a.py')
+    assert not match('a.pyc')
+    assert depth == float('inf')
+
+def test_double_star_in_folder():
+    match, _ = _include_matcher('x/**/*.py')
+    assert match('x/a.py') and match('x/y/a.py')
+    assert not match('a.py') and not match('y/x/a.py')
+
+def test_single_star_does_not_cross_folders():
+    match, depth = _include_matcher('*.py')
+    assert match('a.py')
+    assert not match('x/a.py')
+    assert depth == 0
+
+def test_character_classes():
+    match, _ = _include_matcher('[ab].py')
+    assert match('a.py') and match('b.py') and not match('c.py')
+    match, _ = _include_matcher('[!a].py')
+    assert match('b.py') and not match('a.py')
+    # like glob, classes do not match the path separator
+    match, _ = _include_matcher('x[!a]b.py')
+    assert match('xcb.py') and not match('x/b.py')
+    match, _ = _include_matcher('?.py')
+    assert match('a.py') and not match('ab.py')
+
+def test_dot_slash_prefix():
+    for p in [ './*.py', '././*.py', '/*.py' ]:
+        match, _ = _include_matcher(p)
+        assert match('a.py') and not match('x/a.py'), p
+    match = _exclude_matcher('./data')
+    assert match('data') and not match('x/data')
+
+def test_folder_only_patterns_match_no_files(tree):
+    match, depth = _include_matcher([ './**/' ])
+    assert not match('a.py') and not match('x')
+    assert scan(tree, **{ 'include-patterns': [ './**/' ] }) == []
+
+def test_exclude_anchored_versus_name():
+    anchored = _exclude_matcher('/data')
+    assert anchored('data') and not anchored('x/data')
+    name = _exclude_matcher('data')
+    assert name('data') and name('x/data') and name('x/y/data')
+    assert not name('x/database')
+    path = _exclude_matcher('x/*.txt')
+    assert path('x/notes.txt') and not path('y/x/notes.txt')
+
+def test_exclude_in_scan(tree):
+    assert scan(tree, **{ 'exclude-patterns': [ '/data' ] }) == [
+        'a.py', 'b.mpy', 'x/d.py', 'x/data/i.py', 'x/y/e.py', 'x/y/z/f.py' ]
+    assert scan(tree, **{ 'exclude-patterns': [ 'data', 'y' ] }) == [
+        'a.py', 'b.mpy', 'x/d.py' ]
+    assert scan(tree, **{ 'include-patterns': '**/*.txt', 'exclude-patterns': 'boot_out.txt' }) == [
+        'c.txt', 'x/notes.txt' ]
+
+def test_depth_pruning(tree, monkeypatch):
+    # folders deeper than any include pattern can match are not scanned
+    scanned = []
+    real = os.scandir
+    def scandir(path):
+        scanned.append(os.path.relpath(path, tree / 'lib'))
+        return real(path)
+    monkeypatch.setattr(os, 'scandir', scandir)
+    assert scan(tree, **{ 'include-patterns': [ '*.py', 'x/*.py' ] }) == [ 'a.py', 'x/d.py' ]
+    assert sorted(scanned) == [ '.', 'data', 'x' ]
+    assert _include_matcher([ 'x/y/*.py', '*.py' ])[1] == 2
+
+def test_single_file_resource(tree):
+    assert scan(tree, name='lib/a.py') == [ '.' ]
@@ -0,0 +1,41 @@
+import os
+import pytest
+from iot_device.secrets import Secrets
+
+# secrets from a temporary IOT_SECRETS file
+
+
+@pytest.fixture
+def secrets(tmp_path, monkeypatch):
+    file = tmp_path / 'secrets.py'
+    file.write_text("port = '8266'\npassword = 'abc'\nratio = 0.5\n")
+    monkeypatch.setenv('IOT_SECRETS', str(file))
+    return file
+
+
+def test_default(secrets):
+    assert Secrets.get('missing') is None
+    assert Secrets.get('missing', 42, int) == 42
+    assert Secrets.get_attr('missing', 'x') == 'x'
+
+def test_type(secrets):
+    assert Secrets.get('port') == '8266'
+    assert Secrets.get('port', 0, int) == 8266
+    assert Secrets.get('password', '?', str) == 'abc'
+    assert Secrets.get('ratio', 1, float) == 0.5
+    with pytest.raises(ValueError, match='password'):
+        Secrets.get('password', 0, int)
+
+def test_reload_when_changed(secrets):
+    assert Secrets.get('password') == 'abc'
+    secrets.write_text("password = 'changed'\n")
+    assert Secrets.get('password') == 'changed'
+    assert Secrets.get('port') is None
+
+def test_cached_while_unchanged(secrets):
+    assert Secrets.get('password') == 'abc'
+    st = os.stat(secrets)
+    # same size and mtime: not read again
+    secrets.write_text(secrets.read_text().replace('abc', 'xyz'))
+    os.utime(secrets, ns=(st.st_atime_ns, st.st_mtime_ns))
+    assert Secrets.get('password') == 'abc'